@@ -260,6 +260,9 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--model', dest='model', type=int, default=0,
                         help='selection of model')
 
+    parser.add_argument('--config', dest='overrides', action='append', default=[], metavar='NAME=VALUE',
+                        help='override an attribute of Config, e.g., --config popsize=8 (repeatable)')
+
     args = parser.parse_args()
     if len(args.strategy) <= 0 or len(args.dataset) <= 0:
         logger.error(parser)
@@ -279,6 +282,9 @@ if __name__ == '__main__':
     config = ExperimentalConfig.gen_config()
     config.enable_filters = args.enable_filter
     config.enable_optimize = args.enable_optimize
+    for override in args.overrides:
+        name, value = override.split('=', 1)
+        config.override(name, value)
 
     model_index = int(args.model)
 
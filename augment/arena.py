@@ -0,0 +1,30 @@
+"""
+This program is designed to reuse the buffers of batch level augmentation
+Candidates, selected images and batches are written in place into preallocated buffers, which are only
+reallocated when a larger buffer is requested, so the steady state of training allocates no image buffers.
+"""
+
+import numpy as np
+
+
+class Arena:
+    def __init__(self):
+        self.buffers = dict()
+        self.allocated = 0  # bytes of the buffers of the arena (re)allocated since the last reset_stats
+
+    def get(self, name, shape, dtype='float32'):
+        """the named buffer viewed as shape, the first dimension may be smaller than the allocated one"""
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        buf = self.buffers.get(name)
+        if buf is None or len(buf) < shape[0] or buf.shape[1:] != shape[1:] or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buf
+            self.allocated += buf.nbytes
+        return buf[:shape[0]]
+
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers.values())
+
+    def reset_stats(self):
+        self.allocated = 0
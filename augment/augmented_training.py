@@ -12,6 +12,7 @@ from dataset.imdb.train import IMDBModel
 from dataset.utk.train import UTKModel
 from dataset.kvasir.train import KvasirModel
 import argparse
+import random
 from config import ExperimentalConfig
 from util import SAU, DATASET, logger
 
@@ -60,6 +61,56 @@ if __name__ == '__main__':
                         help='enable filter transformation operators (zoom, blur, contrast, brightness)')
     parser.add_argument('-o', '--optimize', action='store_true', dest='enable_optimize',
                         help='enable selective augmentation')
+    parser.add_argument('-w', '--fused-warp', action='store_true', dest='fused_warp',
+                        help='perform rotation, translation, shear and zoom in a single warp')
+    parser.add_argument('-b', '--batch-perturb', action='store_true', dest='batch_perturb',
+                        help='perturb a batch of images of the same size in one vectorized call')
+    parser.add_argument('-c', '--warp-cache', dest='warp_cache', type=int, default=0,
+                        help='MB of cached remap maps for fused warps (default 0, disabled)')
+    parser.add_argument('-j', '--perturb-workers', dest='perturb_workers', type=int, default=0,
+                        help='the number of threads to perturb images (default 0, main thread only)')
+    parser.add_argument('-p', '--process-perturb', dest='process_perturb', type=int, default=0,
+                        help='the number of processes to perturb the training set (default 0, disabled)')
+    parser.add_argument('-i', '--fused-preprocess', action='store_true', dest='fused_preprocess',
+                        help='resample perturbed images directly to the normalized input of the model')
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=None,
+                        help='the random seed of perturbations (default None, nondeterministic)')
+    parser.add_argument('-v', '--visited', dest='visited', type=int, default=0,
+                        help='hashed slots per image remembering the candidates visited by the genetic '
+                             'algorithm, which are not generated again (default 0, disabled)')
+    parser.add_argument('-k', '--memo', dest='memo', type=str, default='off', choices=['off', 'trust', 'scale'],
+                        help='reuse the loss of the survivors of the genetic algorithm instead of rescoring them, '
+                             'trust: as is, scale: scaled by the change of the loss of the top one (default off)')
+    parser.add_argument('-a', '--memo-age', dest='memo_age', type=int, default=None,
+                        help='the number of training steps a reused loss stays valid (default until the next visit '
+                             'of its batch, 2 * batches per epoch - 1 steps as the batches are shuffled)')
+    parser.add_argument('-u', '--surrogate', dest='surrogate', type=float, default=1.0,
+                        help='the fraction of the children of the genetic algorithm scored by the model, the others '
+                             'are estimated by a nearest neighbor surrogate (default 1.0, disabled)')
+    parser.add_argument('-l', '--staleness', dest='staleness', type=int, default=0,
+                        help='generate batches on a background thread while training, scoring candidates with '
+                             'weights at most STALENESS steps old (default 0, synchronous)')
+    parser.add_argument('-x', '--skip-max', dest='skip_max', type=int, default=0,
+                        help='a sample found robust by -o is skipped for 1, 2, 4, ... epochs after each of its robust '
+                             'evaluations in a row, at most SKIP_MAX epochs (default 0, no limit)')
+    parser.add_argument('-z', '--skip-audit', dest='skip_audit', type=float, default=0.0,
+                        help='the fraction of the skipped samples evaluated again in each epoch (default 0)')
+    parser.add_argument('-y', '--skip-target', dest='skip_target', type=float, default=0.0,
+                        help='calibrate the robust threshold of each class online to skip this fraction of the '
+                             'samples with -o, instead of -r (default 0, disabled)')
+    parser.add_argument('-d', '--epoch-level', action='store_true', dest='epoch_level',
+                        help='select the augmented images of a whole epoch before training on it, perturbed on the '
+                             'processes of -p and stored in a memory mapped file')
+    parser.add_argument('-g', '--graph-score', action='store_true', dest='graph_score',
+                        help='compute the loss of candidates in the graph of the model instead of on the host')
+    parser.add_argument('-n', '--uint8', action='store_true', dest='uint8_input',
+                        help='keep the training images uint8 and normalize them in an input layer of the model')
+    parser.add_argument('--worst-k', dest='worst_k', type=int, default=10,
+                        help='the number of random perturbations of each image in replace_worst_of_10, generated '
+                             'and scored in chunks of Config.worst_chunk (default 10)')
+
+    parser.add_argument('--config', dest='overrides', action='append', default=[], metavar='NAME=VALUE',
+                        help='override an attribute of Config, e.g., --config popsize=8 (repeatable)')
 
     args = parser.parse_args()
 
@@ -86,10 +137,36 @@ if __name__ == '__main__':
     config.popsize = args.queue - config.queue_len
     config.enable_filters = args.enable_filter
     config.enable_optimize = args.enable_optimize
+    config.fused_warp = args.fused_warp
+    config.batch_perturb = args.batch_perturb
+    config.warp_cache_size = args.warp_cache
+    config.perturb_workers = args.perturb_workers
+    if args.process_perturb > 0:
+        config.process_perturb = True
+        config.num_processor = args.process_perturb
+    config.fused_preprocess = args.fused_preprocess
+    config.seed = args.seed
+    config.visited_slots = args.visited
+    config.fitness_memo = args.memo
+    config.fitness_max_age = args.memo_age
+    config.surrogate_budget = args.surrogate
+    config.model_staleness = args.staleness
+    config.skip_max_epochs = args.skip_max
+    config.skip_audit = args.skip_audit
+    config.skip_target = args.skip_target
+    config.epoch_level_augment = args.epoch_level
+    config.graph_score = args.graph_score
+    config.uint8_input = args.uint8_input
+    config.worst_of_k = args.worst_k
+    if args.seed is not None:
+        random.seed(args.seed)
     start_point = args.start_point
     epoch = args.epoch
     model_index = int(args.model)
     config.robust_threshold = 0.1**int(args.threshold)
+    for override in args.overrides:
+        name, value = override.split('=', 1)
+        config.override(name, value)
 
     # initialize dataset
     dat = DATASET.get_name(dataset)
@@ -34,11 +34,8 @@ class Augmenter:
         return x, y
     """
 
-    def random_replace(self, x=None, y=None):
-        length = range(len(x))
-        for i in length:
-            x[i] = self.pt.random_perturb_image(x[i])
-        return x, y
+    def random_replace(self, x=None, y=None, preprocess=None):
+        return self.pt.random_perturb(x, y, preprocess)
 
     def random_augment(self, x=None, y=None):
         augmented_x = []
@@ -66,17 +63,32 @@ class Augmenter:
 
         return x, y
 
-    def worst_of_10(self, x=None, y=None):
-        """randomly generate 10 perturbed examples for each image"""
-        length = range(len(x))
-        x_10 = []
-        for j in range(10):
-            x_i_10 = []
-            for i in length:
-                img = copy.deepcopy(x[i])
-                x_i_10.append(self.pt.random_perturb_image(img))
-            x_10.append(x_i_10)  # num_perturb * n
-        return x_10, y
+    def worst_of_10(self, x=None, y=None, preprocess=None, out=None):
+        """
+        randomly generate 10 perturbed examples for each image
+        preprocess: AffinePreprocess of the dataset, the examples are generated as model input if given
+        out: preallocated (10, n) + model input shape array for the examples generated with preprocess
+        """
+        return self.random_candidates(x, y, 10, preprocess, out)
+
+    def random_candidates(self, x=None, y=None, k=10, preprocess=None, out=None):
+        """
+        randomly generate k perturbed examples for each image
+        out: preallocated (k, n) + model input shape array for the examples generated with preprocess
+        """
+        if self.config.batch_perturb and self.pt.stackable(x):
+            x = np.asarray(x)
+        else:
+            x = list(x)
+        x_k = []
+        for j in range(k):
+            # random_perturb replaces the images of a list in place
+            x_j = x if isinstance(x, np.ndarray) else list(x)
+            out_j = None if out is None else out[j]
+            x_k.append(self.pt.random_perturb(x_j, y, preprocess, out_j)[0])  # num_perturb * n
+        if out is not None:
+            return out, y
+        return x_k, y
 
     def grid(self, x=None, y=None):
         x_grid = []
@@ -1,8 +1,8 @@
 import numpy as np
 from util import logger
-import pickle
-import os.path
-import commands
+import os
+import ast
+import copy
 
 
 class Config:
@@ -20,6 +20,34 @@ class Config:
 
     # to enable translation based on filter
     enable_filters = False  # zoom, blur, brightness, contrast
+    fused_warp = False  # compose rotation, translation, shear and zoom into a single warp
+    batch_perturb = False  # perturb images of the same size in one vectorized call
+    warp_cache_size = 0  # MB of cached remap maps for fused warps (0: disabled)
+    perturb_workers = 0  # the number of threads to perturb images (0: perturb in the main thread)
+    deterministic_perturb = True  # select random parameters before dispatching images to threads
+    process_perturb = False  # perturb the training set on num_processor processes with shared memory
+    fused_preprocess = False  # merge the preprocessing of the dataset into the perturbation warp
+    seed = None  # the seed of the perturbation parameters (None: nondeterministic)
+    batch_buffers = 12  # reused output batches, keras may still queue max_queue_size (10) of them
+    visited_slots = 0  # hashed slots per image remembering the visited candidates of the GA (0: disabled)
+    fitness_memo = "off"  # reuse the loss of GA survivors: off (always rescore), trust, or scale (by the top one)
+    fitness_max_age = None  # model steps a reused loss stays valid (None: until the next visit of its batch)
+    surrogate_budget = 1.0  # the fraction of GA children scored by the model, the others are estimated (1: disabled)
+    surrogate_neighbors = 3  # k of the k nearest neighbor surrogate
+    surrogate_history = 32  # the number of recent evaluations of each image kept for the surrogate
+    model_staleness = 0  # generate batches up to this many training steps ahead on a thread (0: synchronous)
+    worst_of_k = 10  # the number of random perturbations of each image in replace_worst_of_10
+    worst_chunk = 5  # the perturbations of each image generated and scored at once (0: all of them)
+    halving_candidates = 32  # the random perturbations of each image ranked by successive_halving
+    halving_eta = 4  # only the top 1 / eta candidates of each round enter the next one
+    halving_depths = [0.25, 0.5]  # the fraction of the layers of the truncated network of each cheap round
+    score_batch = 0  # images per predict call when scoring candidates (0: tuned on the first batches)
+    skip_max_epochs = 0  # the longest skip of a robust sample after its last evaluation (0: no limit)
+    skip_audit = 0.0  # the fraction of the skipped samples evaluated again in each epoch
+    skip_target = 0.0  # calibrate a robust threshold per class to skip this fraction of samples (0: robust_threshold)
+    threshold_history = 256  # the number of recent losses of each class the thresholds are calibrated on
+    graph_score = False  # compute the loss of candidates in the graph of the model (float32) instead of the host
+    uint8_input = False  # keep the images uint8 up to the model, which normalizes them in an input layer
     """ define translation range """
     rotation_range = range(-30, 31)  # [-30, 30, 1]       - 60
     translate_range = range(-3, 4)  # [-3, 3, 1]         - 6
@@ -37,7 +65,8 @@ class Config:
                         "blur": 1, "brightness": 4, "contrast": 0.05}
 
     enable_optimize = False
-    epoch_level_augment = False
+    epoch_level_augment = False  # select the images of a whole epoch before training on it (worst of 10 and GA)
+    epoch_store_dir = None  # the directory of the memory mapped training set of epoch_level_augment (None: temp)
 
     def print_config(self):
         logger.info("=============== global config ===============")
@@ -47,6 +76,27 @@ class Config:
         logger.info("the number of process (for multiprocessing) : " + str(self.num_processor))
         logger.info("coverage differential threshold : " + str(self.coverage_threshold))
         logger.info("enable transformation based on filter : " + str(self.enable_filters))
+        logger.info("fused warp : " + str(self.fused_warp))
+        logger.info("batch perturbation : " + str(self.batch_perturb))
+        logger.info("warp cache size (MB) : " + str(self.warp_cache_size))
+        logger.info("perturbation threads : " + str(self.perturb_workers))
+        logger.info("perturbation processes : " + str(self.num_processor if self.process_perturb else 0))
+        logger.info("fused preprocessing : " + str(self.fused_preprocess))
+        logger.info("random seed : " + str(self.seed))
+        logger.info("visited candidate slots : " + str(self.visited_slots))
+        logger.info("fitness memoization : " + str(self.fitness_memo) + ", max age : " + str(self.fitness_max_age))
+        logger.info("surrogate budget : " + str(self.surrogate_budget))
+        logger.info("model staleness (prefetched batches) : " + str(self.model_staleness))
+        logger.info("worst of k : " + str(self.worst_of_k) + ", chunk : " + str(self.worst_chunk))
+        logger.info("successive halving : " + str(self.halving_candidates) + " candidates, eta : " +
+                    str(self.halving_eta) + ", depths : " + str(self.halving_depths))
+        logger.info("scoring micro batch : " + str(self.score_batch))
+        logger.info("max skipped epochs : " + str(self.skip_max_epochs))
+        logger.info("skip audit : " + str(self.skip_audit))
+        logger.info("target skip fraction : " + str(self.skip_target))
+        logger.info("epoch level augmentation : " + str(self.epoch_level_augment))
+        logger.info("graph scoring : " + str(self.graph_score))
+        logger.info("uint8 model input : " + str(self.uint8_input))
         logger.info("enable optimize : " + str(self.enable_optimize))
         logger.info("robust_threshold : " + str(self.robust_threshold))
 
@@ -66,26 +116,58 @@ class Config:
     def __init__(self):
         pass
 
+    def known(self, name):
+        return hasattr(self, name) and not callable(getattr(self, name))
+
+    def override(self, name, value):
+        """set an attribute from a string (e.g., command line or environment), parsed as a python literal"""
+        if not self.known(name):
+            raise Exception("unknown config: " + name)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass  # a plain string
+        setattr(self, name, value)
+
+    def snapshot(self):
+        """an immutable copy of the config, e.g., for worker processes"""
+        values = dict()
+        for name in dir(self):
+            if not name.startswith("_") and not callable(getattr(self, name)):
+                values[name] = copy.deepcopy(getattr(self, name))
+        return FrozenConfig(values)
+
+
+class FrozenConfig(Config):
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def __setattr__(self, name, value):
+        raise Exception("config snapshot is immutable: " + name)
+
 
 class ExperimentalConfig:
     config = None
-    # get a system unique id for ubuntu system, 
-    # the system_id can be replaced by any unique system id or even a constant
-    system_id = "1" #commands.getstatusoutput("ifconfig | grep eno1 | awk '{print $NF}' | sed 's/://g'")[1]
+    env_prefix = "SENSEI_"  # e.g., SENSEI_POPSIZE=8 overrides Config.popsize
 
     @staticmethod
     def gen_config():
-        if ExperimentalConfig.config is not None:
-            return ExperimentalConfig.config
-        elif os.path.isfile('/tmp/config' + ExperimentalConfig.system_id + '.pkl'):
-            with open('/tmp/config' + ExperimentalConfig.system_id + '.pkl', 'rb') as inputs:
-                config = pickle.load(inputs)
-        else:
+        """the config of this process, created once with the overrides of the environment"""
+        if ExperimentalConfig.config is None:
             config = Config()
-            ExperimentalConfig.save_config(config)
-        return config
+            for key, value in os.environ.items():
+                if not key.startswith(ExperimentalConfig.env_prefix):
+                    continue
+                name = key[len(ExperimentalConfig.env_prefix):].lower()
+                if not config.known(name):
+                    # e.g., a variable of another tool, only --config rejects unknown names
+                    logger.warning("unknown config in the environment, ignored: " + key)
+                    continue
+                config.override(name, value)
+            ExperimentalConfig.config = config
+        return ExperimentalConfig.config
 
     @staticmethod
     def save_config(config):
-        with open('/tmp/config' + ExperimentalConfig.system_id + '.pkl', 'wb') as output:
-            pickle.dump(config, output, pickle.HIGHEST_PROTOCOL)
+        """replace the config of this process (e.g., with a snapshot in a worker process)"""
+        ExperimentalConfig.config = config
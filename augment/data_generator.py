@@ -12,11 +12,41 @@ from util import SAU, logger
 from config import ExperimentalConfig
 from ga_selector import GASelect
 from neural_coverage import NeuralCoverage
+from warp_cache import WarpCache
+from executor import ProcessExecutor
+from halving import SuccessiveHalving
+from libs.preprocess import dataset_resample
+from arena import Arena
+from prefetch import Prefetcher
+from scorer import Scorer
+from skip_scheduler import SkipScheduler
+from thresholds import ClassThresholds
 import random
 from operator import itemgetter
+import tempfile
 import time
 
 
+class InputModel(keras.models.Model):
+    """
+    the model of a dataset behind an input layer that normalizes the resampled images as preprocess, the weights
+    are shared with the model of the dataset, which saves the checkpoints in its own format
+    """
+
+    def __init__(self, model, preprocess, dtype='uint8'):
+        inputs = keras.layers.Input(shape=preprocess.shape, dtype=dtype)
+        x = keras.layers.Lambda(lambda img: keras.backend.cast(img, 'float32') * preprocess.scale +
+                                preprocess.offset)(inputs)
+        super(InputModel, self).__init__(inputs, model(x))
+        self.dataset_model = model
+
+    def save(self, *args, **kwargs):
+        return self.dataset_model.save(*args, **kwargs)
+
+    def save_weights(self, *args, **kwargs):
+        return self.dataset_model.save_weights(*args, **kwargs)
+
+
 class DataGenerator(keras.utils.Sequence):
     """Generates data for Keras"""
     def __init__(self, original_target=None, model=None, x_original_train=None, y_original_train=None,
@@ -24,6 +54,7 @@ class DataGenerator(keras.utils.Sequence):
 
         self.config = ExperimentalConfig.gen_config()
         self.au = Augmenter()
+        self.au.pt.resample = dataset_resample(original_target)  # batch_perturb crops as the dataset
         self.batch_size = batch_size
         self.original_target = original_target
         self.x_original_train = x_original_train
@@ -32,28 +63,101 @@ class DataGenerator(keras.utils.Sequence):
         self.model = model
         self.graph = graph
 
+        # the samples skipped by selective augmentation, i.e., whose perturbations are not evaluated
+        self.skip = None
         if self.config.enable_optimize:
             self.skipped_node = 0
-
-            self.is_robust = [False] * len(x_original_train)
-            self.prev_is_robust = [False] * len(x_original_train)
+            self.skip = SkipScheduler(len(x_original_train), self.config.skip_max_epochs, self.config.skip_audit,
+                                      self.config.seed)
+        # the robust threshold of each class calibrated to skip the target fraction, instead of robust_threshold
+        self.thresholds = None
+        if self.config.enable_optimize and self.config.skip_target > 0:
+            self.thresholds = ClassThresholds(original_target.num_classes, self.config.skip_target,
+                                              self.config.threshold_history, self.config.robust_threshold)
+
+        # reused buffers of the batches and the perturbed candidates
+        self.arena = Arena()
+        # predict all candidates of a batch in one pass
+        self.scorer = Scorer(model, self.cross_entropy, self.config.score_batch, batch_size, self.config.graph_score)
+        self.batch_count = 0
+        self.model_step = 0  # the number of generated batches, i.e., the training step of the model
 
         # statistic record
         self.total_time = 0
         self.predict_time = 0
-        self.label_record = [[0 for x in range(original_target.num_classes)]
-                             for y in range(original_target.num_classes)]
+        # the number of times each misprediction (true label, predicted label) is selected
+        self.label_record = np.zeros((original_target.num_classes, original_target.num_classes), dtype=np.int64)
+
+        # resample the perturbed images directly to the model input, instead of preprocess_original_imgs
+        self.preprocess = None
+        if self.config.fused_preprocess:
+            self.preprocess = original_target.affine_preprocess()
+        if self.config.uint8_input:
+            # the images stay uint8, normalized by the input layer of the model (see input_model)
+            self.preprocess = original_target.affine_preprocess().resample_only()
 
         temp_x_original_train = copy.deepcopy(self.x_original_train)
         self.y_train = y_original_train
-        self.x_train = original_target.preprocess_original_imgs(temp_x_original_train)
+        self.x_train = self.original_input(temp_x_original_train)
+
+        # perturb on a pool of processes, the perturbed images are resampled to the input size as the dataset does
+        self.process_executor = None
+        if self.config.process_perturb and self.strategy.value != SAU.original.value:
+            dsize = (original_target.input_shape[1], original_target.input_shape[0])
+            self.process_executor = ProcessExecutor(self.x_original_train, dsize, self.config.num_processor,
+                                                    self.preprocess, self.au.pt.resample)
 
         if self.strategy.value == SAU.ga_loss.value:
-            self.ga_selector = GASelect(self.x_original_train, self.y_original_train, self.original_target)
+            self.ga_selector = GASelect(self.x_original_train, self.y_original_train, self.original_target,
+                                        self.process_executor, self.preprocess, self.arena, self.skip)
         elif self.strategy.value == SAU.ga_cov.value:
             self.nc = NeuralCoverage(model)
-            self.ga_selector = GASelect(self.x_original_train, self.y_original_train, self.original_target)
- 
+            self.ga_selector = GASelect(self.x_original_train, self.y_original_train, self.original_target,
+                                        self.process_executor, self.preprocess, self.arena, self.skip)
+        elif self.strategy.value == SAU.successive_halving.value:
+            self.halving = SuccessiveHalving(model, self.config.halving_depths, self.config.halving_eta, batch_size)
+            logger.info("forward passes per image of successive halving : " +
+                        str(self.halving.cost(self.config.halving_candidates)))
+
+        # select the images of a whole epoch before training on it, the training set is memory mapped
+        self.epoch_level = self.config.epoch_level_augment and \
+            self.strategy.value in (SAU.replace_worst_of_10.value, SAU.ga_loss.value, SAU.successive_halving.value)
+        self.epoch_ready = False
+        if self.epoch_level:
+            self.x_train = self.memory_map(self.x_train)
+
+        # generate the next batches on a background thread while the model trains on the current one
+        self.prefetcher = None
+        if self.config.model_staleness > 0 and self.strategy.value != SAU.original.value and not self.epoch_level:
+            if hasattr(self.model, "_make_predict_function"):
+                self.model._make_predict_function()  # build the predict function before it is used by the thread
+            self.prefetcher = Prefetcher(self.generate_batch, len(self), self.config.model_staleness,
+                                         seed=self.config.seed)
+
+    @staticmethod
+    def keras_workers():
+        """
+        the workers of fit_generator, 0 (in order, on the main thread) if the batches are prefetched by the
+        DataGenerator, as the queue of keras would make the model used to score candidates staler, the Prefetcher
+        then shuffles the batches of each epoch instead of keras
+        """
+        return 0 if ExperimentalConfig.gen_config().model_staleness > 0 else 1
+
+    @staticmethod
+    def input_model(original_target, model, x_val=None, strategy=None):
+        """
+        the model fitted on the batches of strategy and its validation data, with uint8_input the model behind an
+        input layer that normalizes the images as the affine_preprocess of the dataset (see InputModel), the
+        input is uint8 unless the batches are mixed up, whose blended pixels are float
+        x_val: the validation data preprocessed by preprocess_original_imgs
+        """
+        config = ExperimentalConfig.gen_config()
+        if strategy is None or not config.uint8_input:
+            return model, x_val
+        preprocess = original_target.affine_preprocess()
+        fit_model = InputModel(model, preprocess, 'float32' if config.mixup else 'uint8')
+        fit_model.compile(optimizer=model.optimizer, loss=model.loss, metrics=model.metrics)
+        return fit_model, None if x_val is None else preprocess.quantize(x_val)
 
     def cross_entropy(self, predictions, targets):
         ce = -np.sum(targets*np.log(predictions)+(1-targets)*np.log(1-predictions), axis=1)
@@ -66,13 +170,55 @@ class DataGenerator(keras.utils.Sequence):
 
     def __getitem__(self, index):
         """Generate one batch of data according to the batch index"""
+        if self.epoch_level:
+            if not self.epoch_ready:
+                self.augment_epoch()
+            start, end = self.batch_range(index)
+            x = self.batch_buffer(end - start)
+            x[...] = self.x_train[start:end]
+            return self.mixup(x, self.y_train[start:end])
+        if self.prefetcher is not None:
+            return self.prefetcher.get(index)
+        return self.generate_batch(index)
+
+    def memory_map(self, x):
+        """a copy of x in a temporary file mapped to memory, deleted when it is closed"""
+        store = np.memmap(tempfile.TemporaryFile(dir=self.config.epoch_store_dir), dtype=x.dtype, mode='w+',
+                          shape=x.shape)
+        store[...] = x
+        return store
+
+    def augment_epoch(self):
+        """
+        select the augmented images of all batches of the epoch into the training set, before training on them,
+        i.e., against the weights at the start of the epoch, the perturbations are generated on the processes of
+        process_perturb
+        """
+        s_time = time.time()
+        for index in range(len(self)):
+            self.generate_batch(index)
+        self.epoch_ready = True
+        logger.info("epoch level augmentation time: " + str(time.time() - s_time))
+
+    def batch_range(self, index):
         start = index*self.batch_size
         end = (index+1)*self.batch_size
         if end > len(self.x_train):
             end = len(self.x_train)
+        return start, end
 
-        x = copy.deepcopy(self.x_train[start:end])
+    def mixup(self, x, y):
+        if self.config.mixup:
+            return self.original_target.mixup(x, y)
+        return x, y
+
+    def generate_batch(self, index):
+        start, end = self.batch_range(index)
+
+        x = self.batch_buffer(end - start)
+        x[...] = self.x_train[start:end]
         y = self.y_train[start:end]
+        self.model_step += 1
 
         # regularly show debug information
         if index % 50 == 0:
@@ -80,69 +226,85 @@ class DataGenerator(keras.utils.Sequence):
 
         # perform batch level augmentation
         if self.strategy.value == SAU.replace_worst_of_10.value:
-            x_origin = self.x_original_train[start:end]
-            temp_x_original_train = copy.copy(x_origin)
-            # generate 10 perturbations
-            x_10, self.y_train = self.au.worst_of_10(temp_x_original_train, self.y_train)
+            # generate and score worst_of_k perturbations in chunks, keeping the worst one of each image
+            skipped = self.skip.skipped[start:end] if self.config.enable_optimize else None
+            x, max_loss, predict_true = self.stream_select_worst(start, end, y, skipped, x)
             if self.config.enable_optimize:
-                x, loss = self.optimized_select_worst(x_10, y, self.prev_is_robust[start:end])
-                max_loss = np.max(loss, axis=0)
-                for j in range(len(max_loss)):
-                    if max_loss[j] < self.config.robust_threshold:  # this node is point-wise robust
-                        self.is_robust[j+start] = True
-            else:
-                x, loss = self.select_worst(x_10, y)
+                self.observe_robust(start, end, y, predict_true, max_loss)
+            self.x_train[start:end] = x
+
+        elif self.strategy.value == SAU.successive_halving.value:
+            # rank many perturbations by truncated networks, only the survivors of the last round are scored
+            skipped = self.skip.skipped[start:end] if self.config.enable_optimize else None
+            x, max_loss, predict_true = self.halving_select_worst(start, end, y, skipped, x)
+            if self.config.enable_optimize:
+                self.observe_robust(start, end, y, predict_true, max_loss)
+            self.x_train[start:end] = x
+
+        elif self.strategy.value == SAU.ga_loss.value and (self.config.fitness_memo != "off" or
+                                                          self.config.surrogate_budget < 1):
+            # generate perturbations using GA, only the candidates without a recent (or estimated) loss are scored
+            is_robust, _ = self.ga_selector.generate_next_population(start, end, render=False)
+            x, loss, predict_true = self.memo_select_worst(y, is_robust, start, end, x)
+            self.observe_robust(start, end, y, predict_true)
             self.x_train[start:end] = x
 
         elif self.strategy.value == SAU.ga_loss.value:
             # generate perturbations using GA
             is_robust, x_n = self.ga_selector.generate_next_population(start, end)  # num_population * num_test
-            if self.config.robust_basedon_acc:
-                is_robust = self.prev_is_robust[start:end]
+            predict_true = None
             if self.config.enable_optimize:
-                x, loss, predict_true = self.optimized_select_worst(x_n, y, is_robust)
-                if self.config.robust_basedon_acc:
-                    for j in range(len(predict_true)):
-                        self.is_robust[j+start] = predict_true[j]
+                x, loss, predict_true = self.optimized_select_worst(x_n, y, is_robust, x)
             else:
-                x, loss = self.select_worst(x_n, y)
+                x, loss = self.select_worst(x_n, y, x)
 
             self.ga_selector.fitness(loss, start, end)
+            self.observe_robust(start, end, y, predict_true)
             self.x_train[start:end] = x
 
         elif self.strategy.value == SAU.ga_cov.value:
             is_robust, x_n = self.ga_selector.generate_next_population(start, end)  # num_population * num_test
-            x, loss = self.generate_cov(x, x_n, y)
+            x_cov, loss = self.generate_cov(x, x_n, y)
             self.ga_selector.fitness(loss, start, end)
-            self.x_train[start:end] = x
+            self.x_train[start:end] = x_cov
+            x[...] = x_cov  # x_cov may be a reused candidate buffer
 
         # regularly show debug information
         # if index % 50 == 0:
         #     self.original_target.test_dnn_model(self.model, "After: Loss of new x: ", x, y)
 
-        if self.config.mixup:
-            x_temp, y_temp = self.original_target.mixup(x, y)
-            return x_temp, y_temp
-
-        return x, y
+        return self.mixup(x, y)
 
     def on_epoch_end(self):
+        if self.prefetcher is not None:
+            self.prefetcher.end_epoch()
+        self.epoch_ready = False
         tf.reset_default_graph()
 
         # debug information at the end of each epoch
         if self.config.enable_optimize:
             print("number of skipped node is: ", self.skipped_node, len(self.y_train))
-            self.prev_is_robust = copy.deepcopy(self.is_robust)
-            self.is_robust = [False] * len(self.x_original_train)
+            stats = self.skip.end_epoch()
+            print("skip ratio: ", stats["skipped"], "audited: ", stats["audited"],
+                  "re-entered: ", stats["reentered"], "robust accuracy: ", stats["robust_acc"])
+            if self.thresholds is not None:
+                print("class thresholds (min, median, max): ", self.thresholds.summary())
 
         print("prediction time is: ", self.predict_time)
         print("selection time is: ", self.total_time)
+        # only the buffers of the arena are counted, not the other allocations of a batch
+        print("arena buffer bytes (re)allocated per batch: ", self.arena.allocated / max(self.batch_count, 1),
+              "arena size: ", self.arena.nbytes())
+        self.arena.reset_stats()
+        self.batch_count = 0
+        if self.config.warp_cache_size > 0:
+            print("warp cache: ", WarpCache.shared().stats())
+            WarpCache.shared().reset_stats()
         
         # reset global info
         self.total_time = 0
         self.predict_time = 0
-        self.label_record = [[0 for x in range(self.original_target.num_classes)]
-                             for y in range(self.original_target.num_classes)]
+        self.label_record[...] = 0
 
         # left-right flip for Cifar-10
         if self.original_target.__class__.__name__ == "Cifar10Model":
@@ -150,6 +312,8 @@ class DataGenerator(keras.utils.Sequence):
                 flip = random.choice([True, False])
                 if flip:
                     self.x_original_train[i] = np.fliplr(self.x_original_train[i])
+                    if self.process_executor is not None:
+                        self.process_executor.update(i, self.x_original_train[i])
             logger.info("Flip done")
 
         """perturb the training sets after each epoch"""
@@ -157,195 +321,411 @@ class DataGenerator(keras.utils.Sequence):
             # if config.data_set == "cifar10":
             if self.original_target.__class__.__name__ == "Cifar10Model":
                 temp_x_original_train = copy.deepcopy(self.x_original_train)
-                self.x_train = self.original_target.preprocess_original_imgs(temp_x_original_train)
+                self.x_train = self.original_input(temp_x_original_train)
             logger.info(" Training on original dataset!!!")
 
         elif self.strategy.value == SAU.replace30.value:
-            temp_x_original_train = copy.deepcopy(self.x_original_train)
-            temp_x_original_train, self.y_train = self.au.random_replace(temp_x_original_train, self.y_train)
+            if self.process_executor is not None:
+                temp_x_original_train = list(self.process_executor.random_perturb(range(len(self.x_original_train)),
+                                                                                  self.au.pt))
+            else:
+                temp_x_original_train = copy.deepcopy(self.x_original_train)
+                temp_x_original_train, self.y_train = self.au.random_replace(temp_x_original_train, self.y_train,
+                                                                             self.preprocess)
             del self.x_train
-            self.x_train = self.original_target.preprocess_original_imgs(temp_x_original_train)
+            self.x_train = self.model_input(temp_x_original_train)
             logger.info(" Augmentation replace30 Done!!!")
 
         elif self.strategy.value == SAU.replace40.value:
             del self.x_train
             temp_x_original_train = copy.deepcopy(self.x_original_train)
             self.x_train, self.y_train = self.au.random40_replace(temp_x_original_train, self.y_train)
-            self.x_train = self.original_target.preprocess_original_imgs(self.x_train)
+            self.x_train = self.original_input(self.x_train)
             logger.info(" Augmentation replace40 Done!!!")
 
 
-    def select_worst(self, x_10=None, y=None):
-        """Evaluate the loss of each image, and select the worst one based on loss"""
+    def robust_threshold(self, labels):
+        """the robust threshold of each image of labels"""
+        if self.thresholds is not None:
+            return self.thresholds(labels)
+        return self.config.robust_threshold
+
+    def observe_robust(self, start, end, y, predict_true=None, robust_loss=None):
+        """
+        observe the robustness of images [start, end), i.e., whether robust_loss is below the robust threshold
+        robust_loss: the max loss of the candidates of each image, default to the top loss of the GA population after
+        the fitness update, in which case the images are robust if all candidates are predicted correctly with
+        robust_basedon_acc
+        predict_true: whether all candidates of each image are predicted correctly
+        """
+        if self.skip is None:
+            return
+        rows = np.arange(start, end)
+        if robust_loss is None and self.config.robust_basedon_acc:
+            self.skip.observe(rows, predict_true, predict_true)
+            return
+        if robust_loss is None:
+            robust_loss = self.ga_selector.population.loss[start:end, 0]
+        labels = np.argmax(y, axis=1)
+        self.skip.observe(rows, robust_loss < self.robust_threshold(labels), predict_true)
+        if self.thresholds is not None:
+            # calibrated on every image, the skipped ones (of low loss) by their top candidate, as they are judged
+            self.thresholds.observe(labels, robust_loss)
+
+    def batch_buffer(self, n):
+        """the next reused buffer of an output batch, keras may still hold the previous ones in its queue"""
+        # the prefetched batches are also held, at most model_staleness of them
+        name = "batch" + str(self.batch_count % (self.config.batch_buffers + self.config.model_staleness))
+        self.batch_count += 1
+        return self.arena.get(name, (n,) + self.x_train.shape[1:], self.x_train.dtype)
+
+    def model_input(self, x):
+        """preprocess perturbed images, unless they are already resampled to the model input"""
+        if self.preprocess is not None:
+            return np.asarray(x)
+        return self.original_target.preprocess_original_imgs(x)
+
+    def original_input(self, x):
+        """preprocess unperturbed images, resampled to uint8 images with uint8_input"""
+        if self.config.uint8_input:
+            return self.preprocess(x)
+        return self.original_target.preprocess_original_imgs(x)
+
+    def candidate_tensor(self, x_n):
+        """the model input of the candidates (num_candidates, n, ...) as one array, x_n if generated in place"""
+        if self.preprocess is not None and isinstance(x_n, np.ndarray):
+            return x_n
+        first = self.model_input(x_n[0])
+        x = self.arena.get("candidates", (len(x_n),) + first.shape, first.dtype)
+        x[0] = first
+        for i in range(1, len(x_n)):
+            x[i] = self.model_input(x_n[i])
+        return x
+
+    def select_worst(self, x_10=None, y=None, out=None):
+        """
+        Evaluate the loss of each image, and select the worst one based on loss
+        out: the array of the selected images, default to x_10[0]
+        """
         ss_time = time.time()
-        for i in range(len(x_10)):
-            x_10[i] = self.original_target.preprocess_original_imgs(x_10[i])
-        num_perturb = len(x_10)
+        x_10 = self.candidate_tensor(x_10)
 
         with self.graph.as_default():
-            y_true = np.array(y, dtype='float64')
-            loss_all = []
-            y_pred_all = []
-            
             s_time = time.time()
-            for i in range(num_perturb):
-                y_pred = self.model.predict_on_batch(x_10[i])
-                y_pred = np.clip(np.array(y_pred, dtype='float64'), 1e-8, 1 - 1e-8)
-                loss = self.cross_entropy(y_pred, y_true)
-                y_pred_all.append(y_pred)
-                loss_all.append(loss)
+            loss_all, pred_all, _ = self.scorer.score_population(x_10, y)
             self.predict_time += time.time() - s_time
-        
-            x_origin = x_10[0]
-            if self.strategy.value == SAU.ga_loss.value:
-                y_argmax = np.argsort(loss_all, axis=0)[-2:][::-1]
-            else:
-                y_argmax = np.argmax(loss_all, axis=0)
-
-            for j in range(len(x_origin)):
-                if self.strategy.value == SAU.ga_loss.value:
-                    index = y_argmax[0][j]
 
-                    true_label = int(np.argmax(y[j]))
-                    predict_label = int(np.argmax(y_pred_all[index][j]))
-                    if true_label != predict_label and self.label_record[true_label][predict_label] > 1000:
-                        index = y_argmax[1][j]
-                        predict_label = np.argmax(y_pred_all[index][j])
-                    self.label_record[true_label][predict_label] += 1
-                else:
-                    index = y_argmax[j]
+        if self.strategy.value == SAU.ga_loss.value:
+            order = np.argsort(loss_all, axis=0)
+            index = self.cap_confusion(order[-1], order[-min(2, len(order))], pred_all, np.argmax(y, axis=1))
+        else:
+            index = np.argmax(loss_all, axis=0)
 
-                if index != 0:
-                    x_origin[j] = x_10[index][j]
+        x_origin = out if out is not None else x_10[0]
+        x_origin[...] = x_10[index, np.arange(len(index))]
 
         self.total_time += time.time() - ss_time
         return x_origin, loss_all
 
-    def optimized_select_worst(self, x_10=None, y=None, is_robust=None):
-        """Evaluate the loss of each image, and select the worst one based on loss"""
+    def cap_confusion(self, index, second, pred_all, labels, allowed=True, limit=1000):
+        """
+        the selected candidate of each image, the second worst one replaces the worst one whose misprediction was
+        selected more than limit times, the record is updated with the selected mispredictions, image by image
+        as the loop of select_worst, only the images whose record may exceed limit within the batch are visited
+        index, second: (n,) the worst and the second worst candidates, pred_all: (num_candidates, n) predicted labels
+        allowed: (n,) bool, whether the second worst candidate can be selected
+        """
+        n = len(index)
+        index = np.array(index)
+        predict = pred_all[index, np.arange(n)]
+        # the other images keep their worst candidate, as their record stays under limit in the batch
+        near = (labels != predict) & (self.label_record[labels, predict] + n > limit) & allowed
+        prev = 0
+        for j in np.nonzero(near)[0]:
+            np.add.at(self.label_record, (labels[prev:j], predict[prev:j]), 1)
+            if self.label_record[labels[j], predict[j]] > limit:
+                index[j] = second[j]
+                predict[j] = pred_all[index[j], j]
+            self.label_record[labels[j], predict[j]] += 1
+            prev = j + 1
+        np.add.at(self.label_record, (labels[prev:], predict[prev:]), 1)
+        return index
+
+    def optimized_select_worst(self, x_10=None, y=None, is_robust=None, out=None):
+        """
+        Evaluate the loss of each image, and select the worst one based on loss
+        the perturbations of the robust nodes are not evaluated, their loss is 0
+        out: the array of the selected images, default to a new array
+        """
         ss_time = time.time()
-        for i in range(len(x_10)):
-            x_10[i] = self.original_target.preprocess_original_imgs(x_10[i])
-        x_10 = np.asarray(x_10)
-
-        n = len(x_10[0])
-        num_perturb = len(x_10)
-
+        x_10 = self.candidate_tensor(x_10)
+        num_perturb, n = x_10.shape[:2]
         logger.debug("original shape", np.shape(x_10))
-        loss_all = []
-        predict_all = []
         self.skipped_node += np.sum(is_robust)
 
-        # calculate the loss of each unrobust node
+        # collect the images that should be evaluated, the original of each node and the perturbations of the
+        # unrobust nodes, and score them in one pass
+        unrobust = np.nonzero(~np.asarray(is_robust, dtype=bool))[0]
+        temp_x = self.arena.get("unrobust", (n + (num_perturb-1) * len(unrobust),) + x_10.shape[2:], x_10.dtype)
+        temp_x[:n] = x_10[0]
+        for i in range(num_perturb-1):
+            np.take(x_10[i+1], unrobust, axis=0, out=temp_x[n+i*len(unrobust):n+(i+1)*len(unrobust)])
+        rows = np.concatenate([np.arange(n), np.tile(unrobust, num_perturb-1)])
         with self.graph.as_default():
-            y_true = np.array(y, dtype='float64')
-            unrobust_y = np.array([y[j] for j in range(n) if not is_robust[j]])
-
             start_time = time.time()
-            y_pred = self.model.predict_on_batch(x_10[0])
+            loss, predict, _ = self.scorer.score(temp_x, np.asarray(y)[rows])
             self.predict_time += time.time() - start_time
 
-            y_pred = np.clip(np.array(y_pred, dtype='float64'), 1e-8, 1 - 1e-8)
-            if self.config.robust_basedon_acc:
-                predict = np.argmax(y_pred, axis=1)
-                predict_all.append(predict)
-            loss = self.cross_entropy(y_pred, y_true)
-            loss_all.append(loss)
-
-            # collect the images that should be evaluate
-            temp_x = []
-            for i in range(num_perturb-1):
-                x_10_i = x_10[i+1]
-                x_10_i = [x_10_i[j] for j in range(n) if not is_robust[j]]
-                temp_x += x_10_i
-
-            # devide the images into batches
-            temp_x = np.array(temp_x)
-            len_temp_x = len(temp_x)
-            y_pred = []
-            for i in range(len_temp_x/n):
-                start = i*n
-                end = start + n
-                start_time = time.time()
-                y_pred_i = self.model.predict_on_batch(temp_x[start: end])
-                self.predict_time += time.time() - start_time
-                y_pred += list(y_pred_i)
-
-            remaining = len_temp_x % n
-            if remaining != 0:
-                start_time = time.time()
-                if len_temp_x >= n:
-                    y_pred_i = self.model.predict_on_batch(temp_x[-n:])
-                else:
-                    y_pred_i = self.model.predict_on_batch(temp_x[-remaining:])
-                self.predict_time += time.time() - start_time
-                y_pred += list(y_pred_i[-remaining:])
-       
-            num_unrobust_node = len(y_pred) / (num_perturb - 1)
-            if num_unrobust_node>0:
-                for i in range(num_perturb-1):
-                    start = i * num_unrobust_node
-                    end = start + num_unrobust_node
-                    y_pred_i = np.clip(np.array(y_pred[start:end], dtype='float64'), 1e-8, 1 - 1e-8)
-                    if self.config.robust_basedon_acc and len(y_pred_i)>0:
-                        predict = np.argmax(y_pred_i, axis=1)
-                        predict_all.append(predict)
-                    unrobust_loss = self.cross_entropy(y_pred_i, unrobust_y)
-                    loss_all.append(unrobust_loss)
-            else:
-                for i in range(num_perturb-1):
-                    loss_all.append([])
-                    if self.config.robust_basedon_acc:
-                        predict_all.append([])
-
-        # add fake loss for the robust node
-        for i in range(n):
-            if is_robust[i]:
-                for j in range(1, num_perturb):
-                    loss_all[j] = np.insert(loss_all[j], i, 0)
-                    if self.config.robust_basedon_acc:
-                        predict_all[j] = np.insert(predict_all[j], i, predict_all[0][i])
-
-
+        # add fake loss for the robust node, its perturbations are predicted as the original
+        loss_all = np.zeros((num_perturb, n))
+        predict_all = np.tile(predict[:n], (num_perturb, 1))
+        loss_all[0] = loss[:n]
+        loss_all[1:, unrobust] = loss[n:].reshape(num_perturb-1, len(unrobust))
+        predict_all[1:, unrobust] = predict[n:].reshape(num_perturb-1, len(unrobust))
         logger.debug("loss shape", np.shape(loss_all))
-        max_loss = loss_all[0]
-        x_origin = x_10[0]
-
-        for i in range(1, num_perturb):
-            loss = loss_all[i]
-            set_i = x_10[i]
-
-            idx = (loss > max_loss)
-            max_loss = np.maximum(loss, max_loss)
-            idx = np.expand_dims(idx, axis=-1)
-            idx = np.expand_dims(idx, axis=-1)
-            idx = np.expand_dims(idx, axis=-1)  # shape (bsize, 1, 1, 1)
-            x_origin = np.where(idx, set_i, x_origin, )  # shape (bsize, 32, 32, 3)
+
+        # the first candidate with the max loss of each image
+        index = np.argmax(loss_all, axis=0)
+        x_origin = out if out is not None else np.empty_like(x_10[0])
+        x_origin[...] = x_10[index, np.arange(n)]
         self.total_time += time.time()-ss_time
 
-        predict_acc = [True] * n
-        if self.config.robust_basedon_acc:
-            labels = np.argmax(y, axis=1)
-            for i in range(n):
-                for j in range(num_perturb):
-                    if predict_all[j][i] != labels[i]:
-                        predict_acc[i] = False
-                        break
+        labels = np.argmax(y, axis=1)
+        predict_acc = [bool(p) for p in np.all(predict_all == labels, axis=0)]
 
         return x_origin, loss_all, predict_acc
 
+    def stream_select_worst(self, start=0, end=0, y=None, skipped=None, out=None):
+        """
+        Generate worst_of_k perturbations of images [start, end) in chunks of worst_chunk, evaluate their loss and
+        keep the worst one of each image, only the running worst image, loss and prediction of each image are kept
+        skipped: (n,) bool, the robust nodes, only their first perturbation is evaluated
+        out: the array of the selected images
+        return: the selected images, the max loss (n,), the prediction accuracy of each image
+        """
+        ss_time = time.time()
+        n = end - start
+        k = self.config.worst_of_k
+        chunk = min(self.config.worst_chunk, k) if self.config.worst_chunk > 0 else k
+        if skipped is not None:
+            self.skipped_node += np.sum(skipped)
+            unrobust = np.nonzero(~np.asarray(skipped, dtype=bool))[0]
+        else:
+            unrobust = np.arange(n)
+        x_origin = self.x_original_train[start:end]
+        max_loss = np.full(n, -np.inf)
+        correct = np.ones(n, dtype=bool)
+        for first in range(0, k, chunk):
+            num = min(chunk, k - first)
+            # generate the perturbations of the chunk, in place if they are resampled to the model input
+            buf = None
+            if self.preprocess is not None:
+                buf = self.arena.get("population", (num, n) + self.x_train.shape[1:], self.x_train.dtype)
+            if self.process_executor is not None:
+                x_c = [self.process_executor.random_perturb(range(start, end), self.au.pt,
+                                                           None if buf is None else buf[j]) for j in range(num)]
+            else:
+                x_c, _ = self.au.random_candidates(copy.copy(x_origin), y, num, self.preprocess, buf)
+            x_c = self.candidate_tensor(x_c)
+
+            self.score_worst(x_c, y, unrobust, first == 0, max_loss, correct, out)
+
+        self.total_time += time.time() - ss_time
+        return out, max_loss, [bool(p) for p in correct]
+
+    def score_worst(self, x_c, y, unrobust, whole, max_loss, correct, out):
+        """
+        Evaluate the loss of the candidates x_c (num, n, ...), of every image for the first one if whole, otherwise
+        of the unrobust nodes only, and replace the images of out whose loss exceeds max_loss (n,) by their first
+        candidate with the max loss (online argmax), max_loss and the prediction accuracy correct (n,) are updated
+        """
+        num, n = x_c.shape[:2]
+        candidate = np.repeat(np.arange(num), len(unrobust))
+        rows = np.tile(unrobust, num)
+        if whole and len(unrobust) < n:
+            candidate = np.concatenate([np.zeros(n, dtype=int), candidate[len(unrobust):]])
+            rows = np.concatenate([np.arange(n), rows[len(unrobust):]])
+        temp_x = self.arena.get("unrobust", (len(rows),) + x_c.shape[2:], x_c.dtype)
+        temp_x[...] = x_c[candidate, rows]
+        with self.graph.as_default():
+            s_time = time.time()
+            loss, predict, _ = self.scorer.score(temp_x, np.asarray(y)[rows])
+            self.predict_time += time.time() - s_time
+
+        loss_c = np.full((num, n), -np.inf)
+        loss_c[candidate, rows] = loss
+        correct[rows[predict != np.argmax(y, axis=1)[rows]]] = False
+        index = np.argmax(loss_c, axis=0)
+        worse = np.nonzero(loss_c[index, np.arange(n)] > max_loss)[0]
+        max_loss[worse] = loss_c[index[worse], worse]
+        out[worse] = x_c[index[worse], worse]
+
+    def perturb_params(self, ids, params, out=None):
+        """
+        perturb the training images ids with params (m, 8), see GASelect.generate_attr
+        out: preallocated array of the model input, used if the images are generated with preprocess
+        """
+        paras = [tuple(p) for p in params.tolist()]
+        if self.process_executor is not None:
+            return self.process_executor.fix_perturb(ids, paras, out)
+        x = [self.x_original_train[i] for i in ids]
+        if self.preprocess is not None:
+            return self.au.pt.preprocess_perturb(x, paras, self.preprocess, out)
+        if self.config.batch_perturb and self.au.pt.stackable(x):
+            return list(self.au.pt.batch_perturb(x, params))
+        if self.au.pt.executor is not None:
+            return self.au.pt.executor.fix_perturb(x, paras)
+        return [self.au.pt.fix_perturb_img(x[i], *paras[i]) for i in range(len(paras))]
+
+    def render_candidates(self, ids, params):
+        """the model input (c, m, ...) of the candidates params (m, c, 8) of the training images ids (m,)"""
+        x_c = None
+        for j in range(params.shape[1]):
+            x_j = self.model_input(self.perturb_params(ids, params[:, j], None if x_c is None else x_c[j]))
+            if x_c is None:
+                x_c = self.arena.get("halving", (params.shape[1],) + x_j.shape, x_j.dtype)
+            x_c[j] = x_j
+        return x_c
+
+    def halving_select_worst(self, start=0, end=0, y=None, skipped=None, out=None):
+        """
+        Select the worst of halving_candidates random perturbations of images [start, end) by successive halving,
+        the candidates are ranked by the truncated networks of the cheap rounds, and the survivors of the last round
+        are evaluated by their loss, only the parameters of the candidates are kept between the rounds
+        skipped: (n,) bool, the robust nodes, only their first candidate is evaluated
+        out: the array of the selected images
+        return: the selected images, the max loss (n,), the prediction accuracy of each image
+        """
+        ss_time = time.time()
+        n = end - start
+        k = self.config.halving_candidates
+        chunk = min(self.config.worst_chunk, k) if self.config.worst_chunk > 0 else k
+        halving = self.halving
+        params = np.asarray(self.au.pt.random_params(n * k), dtype=np.float64).reshape(n, k, -1)
+        if skipped is not None:
+            self.skipped_node += np.sum(skipped)
+            unrobust = np.nonzero(~np.asarray(skipped, dtype=bool))[0]
+        else:
+            unrobust = np.arange(n)
+
+        # the candidates of the unrobust nodes that move the features of the original the most survive each round
+        candidates = np.tile(np.arange(k), (len(unrobust), 1))
+        num = halving.survivors(k)
+        for r in range(len(halving.depths) if len(unrobust) > 0 else 0):
+            with self.graph.as_default():
+                s_time = time.time()
+                origin = halving.features(r, self.original_input([self.x_original_train[i] for i in start + unrobust]))
+                self.predict_time += time.time() - s_time
+            score = np.empty(candidates.shape)
+            for first in range(0, candidates.shape[1], chunk):
+                x_c = self.render_candidates(start + unrobust, params[unrobust[:, np.newaxis],
+                                                                     candidates[:, first:first+chunk]])
+                with self.graph.as_default():
+                    s_time = time.time()
+                    deviation = halving.deviation(r, x_c.reshape((-1,) + x_c.shape[2:]), np.tile(origin, (len(x_c), 1)))
+                    self.predict_time += time.time() - s_time
+                score[:, first:first+len(x_c)] = deviation.reshape(len(x_c), -1).T
+            candidates = halving.keep(candidates, score, num[r + 1])
+
+        # the survivors are evaluated by their loss, the first candidate of the robust nodes only
+        final = np.zeros((n, num[-1]), dtype=int)
+        final[unrobust] = candidates[:, :num[-1]]
+        max_loss = np.full(n, -np.inf)
+        correct = np.ones(n, dtype=bool)
+        for first in range(0, num[-1], chunk):
+            x_c = self.render_candidates(np.arange(start, end), params[np.arange(n)[:, np.newaxis],
+                                                                       final[:, first:first+chunk]])
+            self.score_worst(x_c, y, unrobust, first == 0, max_loss, correct, out)
+
+        self.total_time += time.time() - ss_time
+        return out, max_loss, [bool(p) for p in correct]
+
+    def memo_select_worst(self, y=None, is_robust=None, start=0, end=0, out=None):
+        """
+        Evaluate the loss of the GA candidates of images [start, end) whose loss is not recent, select the worst one
+        of each image and update the fitness of the GA
+        the survivors of former generations keep their loss while it is at most fitness_max_age steps old (None:
+        2 * len(self) - 1 steps, the longest gap between two visits of a batch in shuffled epochs, i.e., the loss
+        scored at the last visit of the batch is always reused), with fitness_memo "scale" it is scaled by the change
+        of the loss of the top candidate, which is always scored
+        the children screened out by the surrogate of the GA keep their estimated loss, but are never selected
+        out: the array of the selected images
+        return: the selected images, the loss (num_candidates, n), the prediction accuracy of each image
+        """
+        ss_time = time.time()
+        ga = self.ga_selector
+        pop = ga.population
+        n = end - start
+        max_age = self.config.fitness_max_age if self.config.fitness_max_age is not None else 2 * len(self) - 1
+        scored = ga.score_mask(start, end, self.model_step, max_age)
+        robust = np.zeros(n, dtype=bool)
+        if self.config.enable_optimize:
+            robust = np.asarray(is_robust, dtype=bool)
+            self.skipped_node += np.sum(robust)
+            scored[1:, robust] = False
+
+        # the cached loss and predicted label of each candidate, (num_candidates, n)
+        num = len(scored)
+        estimated = ~scored & (pop.step[start:end, :num].T < 0)
+        cached_top = pop.loss[start:end, 0].copy()
+        loss_all = pop.loss[start:end, :num].T.copy()
+        pred_all = pop.pred[start:end, :num].T.copy()
+
+        columns, rows = np.nonzero(scored)
+        if len(rows):
+            x_scored = self.model_input(ga.render(start, columns, rows))
+            with self.graph.as_default():
+                s_time = time.time()
+                loss_all[columns, rows], pred_all[columns, rows], _ = self.scorer.score(x_scored, np.asarray(y)[rows])
+                self.predict_time += time.time() - s_time
+
+        cached = ~scored
+        if self.config.fitness_memo == "scale":
+            # scale the cached loss of each image by the change of the loss of its top candidate
+            known = (pop.step[start:end, 0] >= 0) & (cached_top > 0)
+            ratio = np.where(known, loss_all[0] / np.where(known, cached_top, 1), 1)
+            loss_all[cached] = (loss_all * ratio)[cached]
+        loss_all[1:, robust] = 0  # fake loss for the robust node
+        pred_all[1:, robust] = pred_all[0, robust]
+
+        # select the worst candidate of each image, see select_worst and optimized_select_worst
+        labels = np.argmax(y, axis=1)
+        estimated[1:, robust] = False
+        selectable = np.where(estimated, -np.inf, loss_all)
+        order = np.argsort(selectable, axis=0)
+        index = np.argmax(selectable, axis=0) if self.config.enable_optimize else order[-1]
+        if not self.config.enable_optimize and num > 1:
+            index = self.cap_confusion(index, order[-2], pred_all, labels, ~estimated[order[-2], np.arange(n)])
+
+        # the selected images, the cached ones are rendered now
+        position = np.full(scored.shape, -1)
+        position[columns, rows] = np.arange(len(rows))
+        selected = position[index, np.arange(n)]
+        have = np.nonzero(selected >= 0)[0]
+        if len(have):
+            out[have] = np.take(x_scored, selected[have], axis=0)
+        missing = np.nonzero(selected < 0)[0]
+        if len(missing):
+            missing = missing[np.argsort(index[missing], kind='mergesort')]
+            out[missing] = self.model_input(ga.render(start, index[missing], missing, "selected"))
+
+        ga.fitness(loss_all, start, end, self.model_step, pred_all, scored)
+        self.total_time += time.time() - ss_time
+
+        predict_acc = [bool(p) for p in np.all((pred_all == labels) | estimated, axis=0)]
+        return out, loss_all, predict_acc
 
     def generate_cov(self, origin_x=None, x_n=None, y=None):
         """generate loss for each population"""
         for i in range(len(x_n)):
-            x_n[i] = self.original_target.preprocess_original_imgs(x_n[i])
+            x_n[i] = self.model_input(x_n[i])
         # n = len(x_n[0])
         num_perturb = len(x_n)
 
         with self.graph.as_default():
             y_true = np.array(y, dtype='float64')
             cov_all = []
-            o_1 = self.nc.generate_layer_output(self.original_target.preprocess_original_imgs(origin_x))
+            o_1 = self.nc.generate_layer_output(self.original_input(origin_x))
             for i in range(num_perturb):
                 o_2 = self.nc.generate_layer_output(x_n[i])
                 cov = self.nc.compare_output(o_1, o_2)
@@ -0,0 +1,203 @@
+"""
+This program is designed to perturb a batch of images on a pool of workers
+OpenCV releases the GIL during warps, so a pool of threads perturbs images on several cores.
+Transformations that hold the GIL are perturbed on a pool of processes with shared memory instead.
+"""
+
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import ctypes
+import cv2
+import numpy as np
+from config import ExperimentalConfig
+
+
+class PerturbExecutor:
+    pool = None
+
+    def __init__(self, perturbator=None, num_workers=4, deterministic=True):
+        self.pt = perturbator
+        self.num_workers = num_workers
+        self.deterministic = deterministic
+        if PerturbExecutor.pool is None:
+            PerturbExecutor.pool = ThreadPool(num_workers)
+
+    def split(self, n):
+        """split the indices of a batch into chunks, several chunks per worker to balance the load"""
+        num_chunks = max(1, min(n, self.num_workers * 4))
+        return [chunk for chunk in np.array_split(np.arange(n), num_chunks) if len(chunk) > 0]
+
+    def run(self, task, n, streams=False):
+        """streams: pass an independent parameter sampler (see ParamSampler.spawn) with each chunk"""
+        chunks = self.split(n)
+        if streams:
+            chunks = list(zip(chunks, self.pt.sampler.spawn(len(chunks))))
+        if self.deterministic:
+            self.pool.map(task, chunks)
+        else:
+            for _ in self.pool.imap_unordered(task, chunks):
+                pass
+
+    @staticmethod
+    def allocate(x, n, dsize=None):
+        """preallocate the output, an array if the size of output images is fixed, otherwise a list"""
+        if dsize is None:
+            return [None] * n
+        return np.empty((n, dsize[1], dsize[0]) + np.shape(x[0])[2:], dtype=np.asarray(x[0]).dtype)
+
+    def fix_perturb(self, x, params, out=None, dsize=None):
+        """
+        perturb x[i] with params[i] and write the result to out[i]
+        out: preallocated list or array, default to a new one (see allocate)
+        """
+        if out is None:
+            out = self.allocate(x, len(x), dsize)
+
+        def task(chunk):
+            for i in chunk:
+                if dsize is None:
+                    out[i] = self.pt.fix_perturb_img(x[i], *params[i])
+                else:
+                    out[i] = self.pt.fused_perturb_img(x[i], *params[i], dsize=dsize)
+
+        self.run(task, len(x))
+        return out
+
+    def random_perturb(self, x, out=None, dsize=None):
+        """
+        randomly perturb each image of x and write the result to out
+        In deterministic mode, the parameters are selected before dispatching the batch, in the same order as the
+        serial perturbation, otherwise each chunk selects the parameters of its images from its own stream.
+        """
+        if self.deterministic:
+            return self.fix_perturb(x, self.pt.random_params(len(x)), out, dsize)
+
+        if out is None:
+            out = self.allocate(x, len(x), dsize)
+
+        def task(chunk_sampler):
+            chunk, sampler = chunk_sampler
+            for i, paras in zip(chunk, sampler.sample_paras(len(chunk))):
+                if dsize is None:
+                    out[i] = self.pt.fix_perturb_img(x[i], *paras)
+                else:
+                    out[i] = self.pt.fused_perturb_img(x[i], *paras, dsize=dsize)
+
+        self.run(task, len(x), streams=True)
+        return out
+
+
+class SharedArena:
+    """uint8 images of (possibly) different shapes packed into one block of shared memory"""
+
+    def __init__(self, imgs=None, shapes=None, buf=None):
+        if imgs is not None:
+            if np.asarray(imgs[0]).dtype != np.uint8:
+                raise Exception("shared arena only supports uint8 images")
+            shapes = [np.shape(img) for img in imgs]
+        self.shapes = shapes
+        self.offsets = np.concatenate([[0], np.cumsum([int(np.prod(shape)) for shape in shapes])])
+        if buf is None:
+            buf = multiprocessing.RawArray(ctypes.c_uint8, int(self.offsets[-1]))
+        self.buf = buf
+        self.data = np.frombuffer(buf, dtype=np.uint8)
+        if imgs is not None:
+            for i in range(len(imgs)):
+                self[i] = imgs[i]
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i+1]].reshape(self.shapes[i])
+
+    def __setitem__(self, i, img):
+        self.data[self.offsets[i]:self.offsets[i+1]] = np.asarray(img, dtype=np.uint8).ravel()
+
+
+# the arenas and perturbator of a perturbation worker process
+worker_input = None
+worker_output = None
+worker_pt = None
+worker_dsize = None
+worker_preprocess = None
+worker_resample = None
+
+
+def init_worker(input_buf, input_shapes, output_buf, output_shape, dsize, preprocess, resample, config):
+    global worker_input, worker_output, worker_pt, worker_dsize, worker_preprocess, worker_resample
+    from perturbator import Perturbator
+    ExperimentalConfig.save_config(config)
+    worker_input = SharedArena(shapes=input_shapes, buf=input_buf)
+    dtype = np.uint8 if preprocess is None else preprocess.dtype
+    worker_output = np.frombuffer(output_buf, dtype=dtype).reshape(output_shape)
+    worker_pt = Perturbator()
+    worker_dsize = dsize
+    worker_preprocess = preprocess
+    worker_resample = resample
+
+
+def perturb_chunk(task):
+    indices, params = task
+    for i, paras in zip(indices, params):
+        if worker_preprocess is not None:
+            img = worker_pt.fused_perturb_img(worker_input[i], *paras, dsize=worker_dsize,
+                                              preprocess=worker_preprocess)
+            worker_preprocess.normalize(img, worker_output[i])
+            continue
+        # the same as the perturbation in the main process (fused_warp or not), followed by the resample of the
+        # preprocessing of the dataset (e.g., the center crop of Cifar-10) to the size of the output
+        img = worker_pt.fix_perturb_img(worker_input[i], *paras)
+        if worker_resample is not None:
+            img = worker_resample([img])[0]
+        elif (img.shape[1], img.shape[0]) != worker_dsize:
+            img = cv2.resize(img, worker_dsize)
+        worker_output[i] = img.reshape(worker_output[i].shape)
+
+
+class ProcessExecutor:
+    """
+    perturb the training set on a pool of processes
+    The workers read the original images from a shared input arena and write the perturbed images of size dsize
+    to a shared output arena (one slot per training image), so no image is pickled between processes.
+    With preprocess (AffinePreprocess of the dataset), the output arena holds the model input instead.
+    resample: the uint8 resample of the preprocessing of the dataset to dsize (see AffinePreprocess.resample_only),
+    applied to the perturbed images without preprocess, which are only resized to dsize otherwise
+    """
+
+    def __init__(self, x_train=None, dsize=None, num_workers=4, preprocess=None, resample=None):
+        self.dsize = tuple(dsize)
+        self.num_workers = min(num_workers, multiprocessing.cpu_count())
+        self.input = SharedArena(x_train)
+        if preprocess is None:
+            output_shape = (len(x_train), self.dsize[1], self.dsize[0]) + np.shape(x_train[0])[2:]
+            dtype = np.dtype(np.uint8)
+        else:
+            output_shape = (len(x_train),) + preprocess.shape
+            dtype = preprocess.dtype
+        output_buf = multiprocessing.RawArray(ctypes.c_uint8, int(np.prod(output_shape)) * dtype.itemsize)
+        self.output = np.frombuffer(output_buf, dtype=dtype).reshape(output_shape)
+        self.pool = multiprocessing.Pool(self.num_workers, init_worker,
+                                         (self.input.buf, self.input.shapes, output_buf, output_shape,
+                                          self.dsize, preprocess, resample,
+                                          ExperimentalConfig.gen_config().snapshot()))
+
+    def update(self, i, img):
+        """replace an original image (e.g., flipped image of Cifar-10), the shape should not change"""
+        self.input[i] = img
+
+    def fix_perturb(self, indices, params, out=None):
+        """perturb the training images of the indices with params, return a copy of the perturbed images (out)"""
+        indices = np.asarray(indices)
+        num_chunks = max(1, min(len(indices), self.num_workers * 4))
+        tasks = [(indices[chunk], [params[j] for j in chunk])
+                 for chunk in np.array_split(np.arange(len(indices)), num_chunks) if len(chunk) > 0]
+        self.pool.map(perturb_chunk, tasks)
+        return np.take(self.output, indices, axis=0, out=out)
+
+    def random_perturb(self, indices, pt, out=None):
+        """randomly perturb the training images of the indices, the parameters are selected by pt"""
+        return self.fix_perturb(indices, pt.random_params(len(indices)), out)
+
+    def close(self):
+        self.pool.terminate()
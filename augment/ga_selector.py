@@ -1,27 +1,16 @@
-from transformation import Transformation
+from transformation import Transformation, BatchOperator
 import copy
 from config import ExperimentalConfig
 from util import logger
 from perturbator import Perturbator
+from libs.preprocess import dataset_resample
+from population import Population
+from lattice import VisitedTable
+from surrogate import Surrogate
 import random
 import numpy as np
 
 
-class Item(object):
-    def __init__(self, transformation_para=None, loss=0):
-        # self.data = data
-        self.transformation_para = transformation_para
-        self.loss = loss
-
-    def __cmp__(self, other):
-        return cmp(other.loss, self.loss)
-
-    def __lt__(self, other):
-        return other.loss < self.loss
-
-    def compare_trans_para(self, other):
-        return self.transformation_para.compare_paras(other.transformation_para)
-
 class RobustMeasure(object):
     def __init__(self, iterate_num=0, is_robust=False):
         self.iterate_num = iterate_num
@@ -75,12 +64,25 @@ class GridTransformation:
 
 class GASelect:
 
-    def __init__(self, x_train=None, y_train=None, original_target=None):
+    def __init__(self, x_train=None, y_train=None, original_target=None, process_executor=None, preprocess=None,
+                 arena=None, skip=None):
         config = ExperimentalConfig.gen_config()
         self.config = config
-        self.queue_set = []  # num_test * num_mutate
         self.queue_len = config.queue_len
         self.pt = Perturbator()
+        self.pt.resample = dataset_resample(original_target)  # batch_perturb crops as the dataset
+        self.visited = None
+        if config.visited_slots > 0:
+            self.visited = VisitedTable(len(x_train), config.visited_slots)
+        self.operator = BatchOperator(visited=self.visited)
+        # estimate the loss of children from former evaluations, only the most promising ones are scored
+        self.surrogate = None
+        if config.surrogate_budget < 1:
+            self.surrogate = Surrogate(len(x_train), config.surrogate_history, config.surrogate_neighbors)
+        self.process_executor = process_executor
+        self.preprocess = preprocess
+        self.arena = arena
+        self.skip = skip  # the SkipScheduler of selective augmentation
         self.original_target = original_target
 
         self.x_train = x_train
@@ -90,147 +92,218 @@ class GASelect:
         if not self.config.random_init:
             self.gt = GridTransformation(original_target.num_classes)
   
-        # generate first population
-        temp_x_original_train = copy.deepcopy(x_train)
-        for i in range(len(temp_x_original_train)):
-            label = np.argmax(y_train[i])
-            q = list()
-            # add original data to initial population
-            q.append(Item(Transformation(), 1))  # initialize loss as 1
-
-            for j in range(9):
-                if self.config.random_init:
-                    # random init population
-                    angle = random.choice(config.rotation_range)
-                    translation = random.choice(config.translate_range)
-                    shear = random.choice(config.shear_range)
-                    # transformation based on filter
-                    if config.enable_filters:
-                        zoom = random.choice(config.zoom_range)
-                        blur = random.choice(config.blur_range)
-                        brightness = random.choice(config.brightness_range)
-                        contrast = random.choice(config.contrast_range)
-                        tr = Transformation(angle, translation, shear, zoom, blur, brightness, contrast)
-                    else:
-                        tr = Transformation(angle, translation, shear)
-                    q.append(Item(tr, 1))
-                else:
-                    tr = self.gt.get_next_transformation(label)
-                    q.append(Item(tr, 1))
-               
-            self.queue_set.append(q)
-
-    def generate_next_population(self, start=0, end=-1):
+        # generate first population: the original data and 9 perturbations of each image, loss initialized as 1
+        # (num_test * num_mutate), the random parameters of all images are selected in one draw
+        self.population = Population(len(x_train), max(10, self.queue_len) + config.popsize)
+        lattice = self.population.lattice
+        if self.config.random_init:
+            self.population.codes[:, 1:10] = lattice.encode(self.pt.sampler.sample(len(x_train) * 9)).reshape(-1, 9)
+        else:
+            for i in range(len(x_train)):
+                label = np.argmax(y_train[i])
+                paras = [self.gt.get_next_transformation(label).get_paras() for j in range(9)]
+                self.population.codes[i, 1:10] = lattice.encode(paras)
+        self.population.length[:] = 10
+        if self.visited is not None:
+            self.visited.add(np.arange(len(x_train)), self.population.codes[:, :10])
+
+    def generate_next_population(self, start=0, end=-1, render=True):
+        """
+        generate the children of images [start, end)
+        render: return the images of all candidates (num_candidates * num_test), otherwise None (see render)
+        """
         if end == -1:
-            end = len(self.queue_set)
+            end = len(self.population)
         if self.original_target.__class__.__name__ == "Cifar10Model":
             for i in range(start, end):
                 flip = random.choice([True, False])
                 if flip:
                     self.x_train[i] = np.fliplr(self.x_train[i])
+                    if self.process_executor is not None:
+                        self.process_executor.update(i, self.x_train[i])
 
         r = random.choice(range(100)) / float(100)
         if r < self.config.prob_mutate:
-            return self.mutate(start, end)
+            return self.mutate(start, end, render)
         else:
-            return self.crossover(start, end)
-
-    def mutate(self, start=0, end=-1):
-        is_robust = []
+            return self.crossover(start, end, render)
+
+    def robust_children(self, start, end):
+        """
+        check point-wise robustness, the children of a robust image are fake copies of its top candidate
+        the images skipped by the scheduler are robust, otherwise those whose top loss is below the threshold
+        return: the robustness of each image, the children (n, popsize) to be filled for the others
+        """
+        pop = self.population
+        top_loss = pop.loss[start:end, 0]
+        is_robust = np.zeros(end - start, dtype=bool)
+        if self.skip is not None:
+            is_robust = self.skip.skipped[start:end].copy()
+        elif self.config.enable_optimize:
+            is_robust = top_loss < self.config.robust_threshold
+        children = np.repeat(pop.codes[start:end, :1], self.config.popsize, axis=1)
+        return is_robust, children
+
+    def mutate(self, start=0, end=-1, render=True):
         logger.debug("Using mutate operators")
-        for i in range(start, end):
-            q = self.queue_set[i]
-            top_item = q[0]
-
-            # check point-wise robustness
-            if self.config.enable_optimize and top_item.loss < self.config.robust_threshold:
-                # add fake elements
-                for j in range(self.config.popsize):
-                    q.append(top_item)
-                is_robust.append(True)
-                continue
-            is_robust.append(False)
-
-            # generate children using mutation and update queue
-            existing_trs = list(item.transformation_para for item in q)
-            children = top_item.transformation_para.mutate(existing_trs, top_item.loss)
-            for j in range(len(children)):
-                q.append(Item(children[j], 1))
-
-        return is_robust, self.get_all_data(start, end)
-
-    def crossover(self, start=0, end=-1):
-        is_robust = []
+        pop = self.population
+        is_robust, children = self.robust_children(start, end)
+
+        # generate children of all unrobust images using mutation and update population
+        ids = start + np.nonzero(~is_robust)[0]
+        if len(ids):
+            existing = pop.codes[ids, :pop.length[start]]
+            children[ids - start] = self.operator.mutate(existing, pop.loss[ids, 0], ids)
+        self.append_children(start, end, is_robust, children)
+        return is_robust.tolist(), self.get_all_data(start, end) if render else None
+
+    def crossover(self, start=0, end=-1, render=True):
+        pop = self.population
+        if pop.length[start] < 2:
+            return self.mutate(start, end, render)
         logger.debug("Using crossover operators")
-        for i in range(start, end):
-            q = self.queue_set[i]
-            if len(q) < 2:
-                return self.mutate()
-            top_item = q[0]
-
-            # check point-wise robustness
-            if self.config.enable_optimize and top_item.loss < self.config.robust_threshold:
-                for j in range(self.config.popsize):
-                    q.append(top_item)
-                is_robust.append(True)
-                continue
-            is_robust.append(False)
-
-            # generate children using crossover and update queue
-            top_item_2 = self.select_item(top_item, q[1:])
-            existing_trs = list(item.transformation_para for item in q)
-            children = top_item.transformation_para.crossover(top_item_2.transformation_para, existing_trs,
-                                                             top_item.loss)
-            for j in range(len(children)):
-                q.append(Item(children[j], 1))
-        return is_robust, self.get_all_data(start, end)
-
-    def generate_attr(self, start_point, trs):
+        is_robust, children = self.robust_children(start, end)
+
+        # generate children of all unrobust images using crossover and update population
+        ids = start + np.nonzero(~is_robust)[0]
+        if len(ids):
+            existing = pop.codes[ids, :pop.length[start]]
+            paras = pop.lattice.decode(existing)
+            second = existing[np.arange(len(ids)), 1 + self.select_items(paras[:, 0], paras[:, 1:])]
+            children[ids - start] = self.operator.crossover(existing, second, pop.loss[ids, 0], ids)
+        self.append_children(start, end, is_robust, children)
+        return is_robust.tolist(), self.get_all_data(start, end) if render else None
+
+    def append_children(self, start, end, is_robust, children):
+        """ add children to the population, the fake children of robust images keep the loss of the top one """
+        pop = self.population
+        pop.append_slice(start, end, children, np.where(is_robust, pop.loss[start:end, 0], 1))
+        if self.visited is not None:
+            ids = np.nonzero(~is_robust)[0]
+            self.visited.add(start + ids, children[ids])
+
+    def generate_attr(self, rows, params, out=None):
+        """
+        rows: the index of each image
+        params: (n, 8) array, the parameters of the perturbation of each image
+        out: preallocated array of the model input, used if the images are generated with preprocess
+        """
+        paras = [tuple(p) for p in params.tolist()]
+        if self.process_executor is not None:
+            x = self.process_executor.fix_perturb(rows, paras, out)
+            return x if self.preprocess is not None else list(x)
+        if isinstance(self.x_train, np.ndarray):
+            x = self.x_train[rows]
+        else:
+            x = [self.x_train[i] for i in rows]
+        if self.preprocess is not None:
+            return self.pt.preprocess_perturb(x, paras, self.preprocess, out)
+        if self.config.batch_perturb and self.pt.stackable(x):
+            return list(self.pt.batch_perturb(x, params))
+        if self.pt.executor is not None:
+            return self.pt.executor.fix_perturb(x, paras)
         attr = []
-        for i in range(len(trs)):
-            img = copy.deepcopy(self.x_train[start_point+i])
-            mutated_image = self.pt.fix_perturb_img(img, *(trs[i].get_paras()))
+        for i in range(len(paras)):
+            # the perturbation returns a new image, the original one is not modified
+            mutated_image = self.pt.fix_perturb_img(x[i], *paras[i])
             attr.append(mutated_image)
         return attr
 
     def get_all_data(self, start=0, end=-1):
         """ prepare data for feeding DNN """
         ret = []
-        temp_queue_set = self.queue_set[start: end]
-        logger.debug("the shape of queue set: " + str(np.array(temp_queue_set).shape))
-        for i in range(len(temp_queue_set[0])):
-            trs = list(item.transformation_para for item in np.array(temp_queue_set)[:, i])
-            attr = self.generate_attr(start, trs)
+        if end == -1:
+            end = len(self.population)
+        num_mutate = self.population.length[start]
+        logger.debug("the shape of population: " + str((end - start, num_mutate)))
+
+        # with preprocess, the population is generated in place into the arena (num_mutate * num_test)
+        out = None
+        if self.preprocess is not None and self.arena is not None:
+            out = self.arena.get("population", (num_mutate, end - start) + self.preprocess.shape,
+                                 self.preprocess.dtype)
+        for i in range(num_mutate):
+            params = self.population.params(slice(start, end), i)
+            attr = self.generate_attr(np.arange(start, end), params, None if out is None else out[i])
             ret.append(attr)
+        if out is not None:
+            return out
         return ret  # num_mutate * num_test
 
-    def fitness(self, loss, start=0, end=-1):
+    def render(self, start, columns, rows, name="scored"):
+        """
+        the images of some candidates of images [start, end), candidate columns[k] of image start + rows[k]
+        columns: non-decreasing, so that the candidates of a column are generated in one call
+        return: a list of images, or an array of the model input (in the arena buffer name) with preprocess
+        """
+        out = None
+        if self.preprocess is not None:
+            shape = (len(rows),) + self.preprocess.shape
+            out = self.arena.get(name, shape, self.preprocess.dtype) if self.arena is not None \
+                else self.preprocess.allocate(len(rows))
+        ret = []
+        for column in np.unique(columns):
+            begin, end = np.searchsorted(columns, column), np.searchsorted(columns, column, 'right')
+            ids = start + np.asarray(rows[begin:end])
+            attr = self.generate_attr(ids, self.population.params(ids, column),
+                                      None if out is None else out[begin:end])
+            if out is None:
+                ret += list(attr)
+        return out if out is not None else ret
+
+    def score_mask(self, start, end, step, max_age):
+        """
+        (num_candidates, end - start) bool, the candidates to be scored at model step, i.e., the new children and
+        the survivors whose loss is more than max_age steps old (all candidates if fitness_memo is off)
+        with the surrogate, only the surrogate_budget of the children with the highest estimated loss are scored,
+        the others get the estimated loss and stay unscored (step -1)
+        """
+        pop = self.population
+        num = pop.length[start]
+        scored_at = pop.step[start:end, :num].T
+        if self.config.fitness_memo == "off":
+            mask = np.ones(scored_at.shape, dtype=bool)
+        else:
+            mask = (scored_at < 0) | (step - scored_at > max_age)
+            if self.config.fitness_memo == "scale":
+                mask[0] = True  # the change of the loss of the top candidate scales the cached loss of the others
+
+        if self.surrogate is not None and num > self.config.popsize:
+            children = slice(num - self.config.popsize, num)
+            keep = max(1, int(np.ceil(self.config.surrogate_budget * self.config.popsize)))
+            selected, estimate = self.surrogate.screen(np.arange(start, end), pop.codes[start:end, children], keep)
+            mask[children] &= selected.T
+            pop.loss[start:end, children] = np.where(selected, pop.loss[start:end, children],
+                                                     np.nan_to_num(estimate))
+        return mask
+
+    def fitness(self, loss, start=0, end=-1, step=None, pred=None, scored=None):
+        """
+        loss: (num_candidates, end - start)
+        step, pred, scored: the model step and predicted labels of the scored candidates, see Population.update
+        """
         if end == -1:
-            end = len(self.queue_set)
-
-        logger.debug("update_queue - the shape of loss: " + str(np.array(loss).shape))
-        index = 0
-        for i in range(start, end):         # for each test
-            for j in range(len(self.queue_set[i])):  # for each mutation
-                self.queue_set[i][j].loss = loss[j][index]
-            index += 1
-            self.queue_set[i].sort()
-            # keep the top n and remove test with small loss
-            self.queue_set[i] = self.queue_set[i][0:self.queue_len]
+            end = len(self.population)
+
+        logger.debug("update_queue - the shape of loss: " + str(np.shape(loss)))
+        # sort the candidates of each test by loss, keep the top n and remove those with small loss
+        if self.surrogate is not None:
+            loss = np.asarray(loss)
+            for i in range(len(loss)):
+                rows = np.arange(end - start) if scored is None else np.nonzero(scored[i])[0]
+                self.surrogate.observe(start + rows, self.population.codes[start + rows, i], loss[i, rows])
+        self.population.update(loss, start, end, self.queue_len, step, pred, scored)
         if start == 0:
-            for i in range(start, 20):  # for each test
-                print("transformation para of " + str(i), self.queue_set[i][0].transformation_para.get_paras())
+            for i in range(start, min(20, end)):  # for each test
+                print("transformation para of " + str(i), tuple(self.population.params(i, 0).tolist()))
         logger.debug("update queue done")
 
     @ staticmethod
-    def select_item(top_item, queue):
-        """ select best item for crossover """
-        maximal = 0
-        top_item2 = queue[0]
-        for item2 in queue:
-            diff = top_item.compare_trans_para(item2)
-            if diff > maximal:
-                maximal = diff
-                top_item2 = item2
-        return top_item2
+    def select_items(top_paras, candidates):
+        """
+        select best item for crossover of each image, i.e., the index of the candidate that differs in most
+        parameters from the top one
+        top_paras: (n, 8), candidates: (n, l, 8)
+        """
+        return np.argmax((candidates != top_paras[:, np.newaxis]).sum(axis=2), axis=1)
 
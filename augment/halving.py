@@ -0,0 +1,71 @@
+"""
+This program is designed to find the worst perturbation of each image with a small budget of forward passes
+Many random candidates of each image are ranked by the network truncated at increasing depths, by how far they move
+the features of the image, and only the top 1 / eta of them enter the next round, up to the full network, whose loss
+selects the worst one (successive halving over the depth of the network).
+"""
+
+import numpy as np
+from util import logger
+
+
+class SuccessiveHalving:
+    """
+    model: the keras model, the model of DataGenerator.input_model is truncated behind its input layer
+    depths: the fraction of the layers of each cheap round, increasing, followed by the round of the full network
+    eta: the reduction factor of the candidates of each image between two rounds
+    batch_size: the number of images per predict_on_batch of the truncated networks
+    """
+
+    def __init__(self, model, depths=(0.25, 0.5), eta=4, batch_size=128):
+        self.model = model
+        self.depths = [d for d in depths if 0 < d < 1]
+        self.eta = max(eta, 1)
+        self.batch_size = batch_size
+        self.models = dict()  # the truncated network of each round, built on first use
+
+    def truncate(self, depth):
+        """the network from the input of model to the output of the first depth fraction of its layers"""
+        import keras
+        inner = self.model.layers[-1]
+        base = inner if isinstance(inner, keras.models.Model) else self.model
+        layers = [layer for layer in base.layers if not isinstance(layer, keras.layers.InputLayer)]
+        layer = layers[min(max(int(round(depth * len(layers))), 1), len(layers)) - 1]
+        truncated = keras.models.Model(base.input, layer.get_output_at(0))
+        if base is not self.model:
+            truncated = keras.models.Model(self.model.input, truncated(inner.get_input_at(-1)))
+        if hasattr(truncated, "_make_predict_function"):
+            truncated._make_predict_function()  # predicted by the thread of the prefetcher
+        logger.info("round of depth " + str(depth) + " truncated after layer " + layer.name)
+        return truncated
+
+    def features(self, r, x):
+        """(m, d) the flattened features of the images x (m, ...) of the network of round r"""
+        if r not in self.models:
+            self.models[r] = self.truncate(self.depths[r])
+        model = self.models[r]
+        out = [np.asarray(model.predict_on_batch(x[i:i+self.batch_size]), dtype='float32')
+               for i in range(0, len(x), self.batch_size)]
+        return np.concatenate(out).reshape(len(x), -1)
+
+    def deviation(self, r, x, origin):
+        """(m,) the squared distance of the features of x (m, ...) to the features origin (m, d) of the originals"""
+        return np.sum((self.features(r, x) - origin) ** 2, axis=1)
+
+    def survivors(self, k):
+        """the number of candidates of each image scored in each round, the last one by the full network"""
+        num = [k]
+        for _ in self.depths:
+            num.append(int(np.ceil(num[-1] * 1.0 / self.eta)))
+        return num
+
+    def cost(self, k):
+        """the forward passes per image of the rounds of k candidates and the original, in units of the full network"""
+        num = self.survivors(k)
+        return float(np.dot(np.add(num[:-1], 1), self.depths) + num[-1])
+
+    @staticmethod
+    def keep(candidates, score, num):
+        """the num candidates (n, num) of each image with the highest score (n, m) among candidates (n, m)"""
+        order = np.argsort(-score, axis=1, kind='mergesort')[:, :num]
+        return np.take_along_axis(candidates, order, axis=1)
@@ -0,0 +1,93 @@
+"""
+This program is designed to encode the parameters of a transformation as one integer
+Each parameter is snapped to its index in the range of Config, and the indices of the 8 parameters are combined
+into one index of the parameter lattice, so that candidates are stored and compared as int64 codes.
+"""
+
+import numpy as np
+from config import ExperimentalConfig
+
+
+class Lattice:
+    lattice = None
+
+    def __init__(self):
+        config = ExperimentalConfig.gen_config()
+        # rotation, translate, translate_v, shear, zoom, blur, brightness, contrast
+        axes = [config.rotation_range, config.translate_range, config.translate_range, config.shear_range]
+        if config.enable_filters:
+            axes += [config.zoom_range, config.blur_range, config.brightness_range, config.contrast_range]
+        else:
+            axes += [[1], [0], [0], [1]]
+        self.axes = [np.unique(np.asarray(axis, dtype=np.float64)) for axis in axes]
+        self.sizes = np.array([len(axis) for axis in self.axes], dtype=np.int64)
+        if np.sum(np.log2(self.sizes)) >= 62:
+            raise Exception("the parameter lattice is too large to be indexed by int64: " + str(self.sizes))
+        # mixed radix, the index of rotation varies slowest
+        self.strides = np.cumprod(np.concatenate([self.sizes[1:], [1]])[::-1])[::-1].astype(np.int64)
+        self.size = int(np.prod(self.sizes))
+
+    @staticmethod
+    def shared():
+        if Lattice.lattice is None:
+            Lattice.lattice = Lattice()
+        return Lattice.lattice
+
+    def indices(self, params):
+        """(..., 8) the index of the nearest value of each parameter in its range"""
+        params = np.asarray(params, dtype=np.float64)
+        idx = np.empty(params.shape, dtype=np.int64)
+        for c, axis in enumerate(self.axes):
+            value = params[..., c]
+            upper = np.minimum(np.searchsorted(axis, value), len(axis) - 1)
+            lower = np.maximum(upper - 1, 0)
+            idx[..., c] = np.where(np.abs(value - axis[lower]) <= np.abs(axis[upper] - value), lower, upper)
+        return idx
+
+    def encode(self, params):
+        """(...) int64 codes of parameters (..., 8), values out of the ranges are clipped"""
+        return self.indices(params).dot(self.strides)
+
+    def unravel(self, codes):
+        """(..., 8) the index of each parameter of int64 codes (...)"""
+        return (np.asarray(codes, dtype=np.int64)[..., np.newaxis] // self.strides) % self.sizes
+
+    def decode(self, codes):
+        """(..., 8) parameters of int64 codes (...), the values are taken from the ranges of Config"""
+        idx = self.unravel(codes)
+        params = np.empty(idx.shape, dtype=np.float64)
+        for c, axis in enumerate(self.axes):
+            params[..., c] = axis[idx[..., c]]
+        return params
+
+
+class VisitedTable:
+    """
+    the candidates visited by the genetic algorithm of each image across generations, a direct mapped hash table
+    of codes per image, a colliding code replaces the old one (a visited candidate may be forgotten, but an
+    unvisited one is never reported as visited)
+    """
+
+    def __init__(self, num_images, slots):
+        self.bits = max(int(np.ceil(np.log2(max(slots, 2)))), 1)
+        self.codes = np.full((num_images, 1 << self.bits), -1, dtype=np.int64)
+
+    def slot(self, codes):
+        # Fibonacci hashing, the high bits of code * 2^64 / golden ratio
+        with np.errstate(over='ignore'):
+            h = np.asarray(codes, dtype=np.int64).astype(np.uint64) * np.uint64(11400714819323198485)
+        return (h >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def contains(self, rows, codes):
+        """(n, k) bool, whether codes (n, k) are visited by images rows (n,)"""
+        rows = np.asarray(rows)[:, np.newaxis]
+        return self.codes[rows, self.slot(codes)] == codes
+
+    def add(self, rows, codes):
+        """mark codes (n, k) as visited by images rows (n,)"""
+        codes = np.asarray(codes, dtype=np.int64)
+        rows = np.broadcast_to(np.asarray(rows)[:, np.newaxis], codes.shape)
+        self.codes[rows, self.slot(codes)] = codes
+
+    def nbytes(self):
+        return self.codes.nbytes
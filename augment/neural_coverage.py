@@ -1,6 +1,6 @@
 from collections import defaultdict, OrderedDict
 from keras.models import Model
-from augment.config import *
+from config import *
 import multiprocessing
 from config import ExperimentalConfig
 from keras.backend import int_shape
@@ -7,6 +7,9 @@ Time: Sep, 25, 2018
 import random
 
 from config import ExperimentalConfig
+from warp_cache import WarpCache
+from executor import PerturbExecutor
+from sampler import ParamSampler
 from libs.spacial_transformation import *
 
 
@@ -32,11 +35,26 @@ class Perturbator:
         self.trans_functions["blur"] = image_blur
         self.trans_functions["contrast"] = image_contrast
         self.trans_functions["brightness"] = image_brightness
+        self.trans_functions["brightness_contrast"] = self.brightness_contrast
+        self.luts = dict()  # (brightness, contrast) -> lookup table
 
         self.enable_filters = config.enable_filters
+        self.sampler = ParamSampler.shared().copy()
+        self.fused_warp = config.fused_warp
+        self.batch_perturb_enabled = config.batch_perturb
+        # the uint8 resample of the preprocessing of the dataset (see AffinePreprocess.resample_only), applied by
+        # batch_perturb to the images perturbed without preprocess, e.g., the center crop of Cifar-10
+        self.resample = None
+        self.warp_cache = None
+        if config.warp_cache_size > 0:
+            self.warp_cache = WarpCache.shared(config.warp_cache_size * 1024 * 1024)
+        self.executor = None
+        if config.perturb_workers > 0:
+            self.executor = PerturbExecutor(self, config.perturb_workers, config.deterministic_perturb)
 
     def set_rotation_range(self, _range=30):
         self.rotation_range = range(_range*-1, _range)
+        self.sampler.ranges[0] = np.asarray(self.rotation_range)
 
     def random_rotate_perturb(self, x=None, y=None):
         for i in range(len(x)):
@@ -44,41 +62,149 @@ class Perturbator:
             x[i] = self.trans_functions["rotate"](x[i], angle)
         return x, y
 
-    def random_perturb(self, x=None, y=None):
+    def random_perturb(self, x=None, y=None, preprocess=None, out=None):
+        if preprocess is not None:
+            return self.preprocess_perturb(x, self.random_params(len(x)), preprocess, out), y
+        if self.batch_perturb_enabled and self.stackable(x):
+            return list(self.batch_perturb(x, self.sampler.sample(len(x)))), y
+        if self.executor is not None:
+            return self.executor.random_perturb(x, out=x if isinstance(x, list) else None), y
         for i in range(len(x)):
             x[i] = self.random_perturb_image(x[i])
         return x, y
 
+    def random_paras(self):
+        """randomly select the parameters of one perturbation"""
+        return self.sampler.sample_paras(1)[0]
+
+    def random_params(self, n):
+        """randomly select the parameters of n perturbations in one draw, a list of tuples (see random_paras)"""
+        return self.sampler.sample_paras(n)
+
     def random_perturb_image(self, img=None):
         """randomly perturb one image"""
-        # spacial transformation
-        angle = random.choice(self.rotation_range)
-        translation = random.choice(self.translate_range)
-        translation_v = random.choice(self.translate_range)
-        shear = random.choice(self.shear_range)
-        zoom = 1
-        blur = 0
-        brightness = 0
-        contrast = 1
-        # transformation based on filter
-        if self.enable_filters:
-            zoom = random.choice(self.zoom_range)
-            blur = random.choice(self.blur_range)
-            brightness = random.choice(self.brightness_range)
-            contrast = random.choice(self.contrast_range)
-        img = self.fix_perturb_img(img, angle, translation, translation_v, shear, zoom, blur, brightness, contrast)
+        img = self.fix_perturb_img(img, *self.random_paras())
         return img
 
     def fix_perturb(self, x=None, y=None, angle=15, translation=2, translation_v=0, shear=0.1,
                     zoom=1, blur=0,  brightness=0, contrast=1):
+        if self.batch_perturb_enabled and self.stackable(x):
+            params = np.tile([angle, translation, translation_v, shear, zoom, blur, brightness, contrast],
+                             (len(x), 1))
+            return list(self.batch_perturb(x, params)), y
+        if self.executor is not None:
+            params = [(angle, translation, translation_v, shear, zoom, blur, brightness, contrast)] * len(x)
+            return self.executor.fix_perturb(x, params, out=x if isinstance(x, list) else None), y
         length = range(len(x))
         for i in length:
             x[i] = self.fix_perturb_img(x[i], angle, translation, translation_v,
                                         shear, zoom, blur, brightness, contrast)
         return x, y
 
+    @staticmethod
+    def stackable(x):
+        """whether the images have the same shape, i.e., can be perturbed by batch_perturb"""
+        if isinstance(x, np.ndarray):
+            return x.ndim >= 3
+        return len(x) > 0 and all(np.shape(img) == np.shape(x[0]) for img in x)
+
+    def batch_perturb(self, x, params, dsize=None, preprocess=None, out=None):
+        """
+        perturb a batch of images in one call, each image with its own parameters
+        x: (N, rows, cols[, ch]) uint8 images
+        params: (N, 8) array of (rotation, translate, translate_v, shear, zoom, blur, brightness, contrast)
+        dsize: (cols, rows) of the output, default to the size of the input. Each image is resized to
+               dsize after the perturbation (fix_perturb_img changes the size of images), which differs from the
+               preprocessing of a dataset that crops the images, so it should be the size of the input
+        preprocess: AffinePreprocess of the dataset, return the model input (written to out) if given
+        Without preprocess and dsize, the images are resampled by self.resample if set, i.e., as fix_perturb_img
+        followed by the preprocessing of the dataset, to uint8 images of the input size of the model
+        """
+        x = np.asarray(x)
+        params = np.asarray(params, dtype=np.float64)
+        resampled = preprocess is None and dsize is None and self.resample is not None
+        if resampled:
+            preprocess = self.resample
+        center_crop = False
+        if preprocess is not None:
+            dsize = preprocess.dsize
+            center_crop = preprocess.center_crop
+        elif dsize is None:
+            dsize = (x.shape[2], x.shape[1])
+        elif tuple(dsize) != (x.shape[2], x.shape[1]):
+            raise Exception("batch_perturb resizes to " + str(tuple(dsize)) + " without the crop of the dataset, "
+                            "pass the preprocess of the dataset instead")
+
+        geometric = params[:, 0:5].copy()
+        if not self.enable_filters:
+            geometric[:, 4] = 1
+        matrices = batch_geometric_matrix(x.shape[1:], geometric, dsize, center_crop)
+        x = batch_warp_affine(x, matrices, dsize)
+        if self.enable_filters:
+            x = self.batch_filters(x, params)
+        if preprocess is not None:
+            if out is None:
+                out = preprocess.allocate(len(x))
+            out = preprocess.normalize(x, out)
+            return out.reshape(x.shape) if resampled else out
+        return x
+
+    def preprocess_perturb(self, x, params, preprocess, out=None):
+        """
+        perturb x[i] with params[i] and resample the result directly to the model input, i.e., the same as
+        preprocess_original_imgs of the perturbed images, but with a single warp and no intermediate image
+        preprocess: AffinePreprocess of the dataset
+        return: (N,) + model input shape array (out if given)
+        """
+        if out is None:
+            out = preprocess.allocate(len(x))
+        if self.batch_perturb_enabled and self.stackable(x):
+            return self.batch_perturb(x, params, preprocess=preprocess, out=out)
+
+        def task(chunk):
+            for i in chunk:
+                preprocess.normalize(self.fused_perturb_img(x[i], *params[i], preprocess=preprocess), out[i])
+
+        if self.executor is not None:
+            self.executor.run(task, len(x))
+        else:
+            task(range(len(x)))
+        return out
+
+    def batch_filters(self, x, params):
+        """apply blur, brightness and contrast to a batch of images"""
+        blur = params[:, 5].astype(int)
+        for i in np.nonzero(blur)[0]:
+            x[i] = self.trans_functions["blur"](x[i], blur[i])
+        luts = np.array([self.get_lut(b, c) for b, c in params[:, 6:8]])
+        index = np.arange(len(x)).reshape((-1,) + (1,) * (x.ndim - 1))
+        return luts[index, x]
+
+    def get_lut(self, brightness=0, contrast=1):
+        """the cached lookup table of brightness and contrast"""
+        key = (round(brightness, 6), round(contrast, 6))
+        lut = self.luts.get(key)
+        if lut is None:
+            lut = photometric_lut(brightness, contrast)
+            self.luts[key] = lut
+        return lut
+
+    def brightness_contrast(self, img, brightness=0, contrast=1):
+        """the same as image_brightness followed by image_contrast, but in a single lookup table pass"""
+        if brightness == 0 and contrast == 1:
+            return img
+        return cv2.LUT(img, self.get_lut(brightness, contrast))
+
     def fix_perturb_img(self, img, angle=15, translation=0, translation_v=0, shear=0.1,
                         zoom=1, blur=0, brightness=0, contrast=1):
+        if self.fused_warp:
+            return self.fused_perturb_img(img, angle, translation, translation_v, shear,
+                                          zoom, blur, brightness, contrast)
+        return self.chain_perturb_img(img, angle, translation, translation_v, shear,
+                                      zoom, blur, brightness, contrast)
+
+    def chain_perturb_img(self, img, angle=15, translation=0, translation_v=0, shear=0.1,
+                          zoom=1, blur=0, brightness=0, contrast=1):
         # img = img[:, :, ::-1]
         # translation_v = random.choice(self.translate_range)
         img = self.trans_functions["rotate"](img, angle)
@@ -87,7 +213,30 @@ class Perturbator:
         if self.enable_filters:
             img = self.trans_functions["zoom"](img, zoom)
             img = self.trans_functions["blur"](img, blur)
-            img = self.trans_functions["brightness"](img, brightness)
-            img = self.trans_functions["contrast"](img, contrast)
+            img = self.trans_functions["brightness_contrast"](img, brightness, contrast)
         # img = img[:, :, ::-1]
         return img
+
+    def fused_perturb_img(self, img, angle=15, translation=0, translation_v=0, shear=0.1,
+                          zoom=1, blur=0, brightness=0, contrast=1, dsize=None, preprocess=None):
+        """perturb one image with a single warp instead of one warp per spacial transformation"""
+        if not self.enable_filters:
+            zoom = 1
+        if self.warp_cache is not None:
+            img = self.warp_cache.warp(img, angle, translation, translation_v, shear, zoom, dsize, preprocess)
+        else:
+            img = image_geometric_fused(img, angle, translation, translation_v, shear, zoom, dsize, preprocess)
+        if not self.enable_filters:
+            return img
+        img = self.trans_functions["blur"](img, blur)
+        img = self.trans_functions["brightness_contrast"](img, brightness, contrast)
+        return img
+
+    def compare_fused(self, img, angle=15, translation=0, translation_v=0, shear=0.1,
+                      zoom=1, blur=0, brightness=0, contrast=1):
+        """check the fused warp against the chain, return the max and mean absolute pixel difference"""
+        paras = (angle, translation, translation_v, shear, zoom, blur, brightness, contrast)
+        chain_img = np.int16(self.chain_perturb_img(img, *paras))
+        fused_img = np.int16(self.fused_perturb_img(img, *paras))
+        diff = np.abs(chain_img - fused_img)
+        return diff.max(), diff.mean()
@@ -0,0 +1,92 @@
+"""
+This program is designed to store the populations of the genetic algorithm in columns
+The candidates of all images are kept in one array of lattice codes (see lattice.py) and one loss array instead of
+lists of objects, so that the fitness update, sorting and truncation of a batch are a few vectorized operations.
+"""
+
+import numpy as np
+from lattice import Lattice
+
+# rotation, translate, translate_v, shear, zoom, blur, brightness, contrast of the original image
+IDENTITY = [0, 0, 0, 0, 1, 0, 0, 1]
+
+
+class Population:
+    def __init__(self, num_images, capacity=20, lattice=None):
+        self.lattice = lattice if lattice is not None else Lattice.shared()
+        self.identity = int(self.lattice.encode(IDENTITY))
+        self.codes = np.full((num_images, capacity), self.identity, dtype=np.int64)  # (N, P)
+        self.loss = np.ones((num_images, capacity))  # (N, P)
+        self.length = np.zeros(num_images, dtype=int)  # the number of candidates of each image
+        # the model step at which the loss was computed (-1: not scored yet) and the predicted label (-1: unknown)
+        self.step = np.full((num_images, capacity), -1, dtype=np.int64)
+        self.pred = np.full((num_images, capacity), -1, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.length)
+
+    def reserve(self, capacity):
+        """grow the number of candidate slots of each image to at least capacity"""
+        extra = capacity - self.codes.shape[1]
+        if extra <= 0:
+            return
+        self.codes = np.concatenate([self.codes, np.full((len(self), extra), self.identity, dtype=np.int64)], axis=1)
+        self.loss = np.concatenate([self.loss, np.ones((len(self), extra))], axis=1)
+        self.step = np.concatenate([self.step, np.full((len(self), extra), -1, dtype=np.int64)], axis=1)
+        self.pred = np.concatenate([self.pred, np.full((len(self), extra), -1, dtype=np.int32)], axis=1)
+
+    def params(self, rows, column):
+        """(n, 8) parameters of the candidate column of images rows"""
+        return self.lattice.decode(self.codes[rows, column])
+
+    def append(self, i, params, loss=1):
+        """append candidates (k, 8) to the population of image i"""
+        codes = self.lattice.encode(np.reshape(params, (-1, 8)))
+        begin = self.length[i]
+        end = begin + len(codes)
+        self.reserve(end)
+        self.codes[i, begin:end] = codes
+        self.loss[i, begin:end] = loss
+        self.step[i, begin:end] = -1
+        self.pred[i, begin:end] = -1
+        self.length[i] = end
+
+    def append_slice(self, start, end, codes, loss=1):
+        """append candidates (end - start, k) to the populations of images [start, end), all of the same length"""
+        begin = self.length[start]
+        assert np.all(self.length[start:end] == begin), "the populations of the slice differ in length"
+        self.reserve(begin + codes.shape[1])
+        self.codes[start:end, begin:begin + codes.shape[1]] = codes
+        self.loss[start:end, begin:begin + codes.shape[1]] = np.reshape(loss, (-1, 1))
+        self.step[start:end, begin:begin + codes.shape[1]] = -1
+        self.pred[start:end, begin:begin + codes.shape[1]] = -1
+        self.length[start:end] = begin + codes.shape[1]
+
+    def candidates(self, i):
+        """the parameters of the candidates of image i, a list of tuples"""
+        return [tuple(paras) for paras in self.lattice.decode(self.codes[i, :self.length[i]]).tolist()]
+
+    def update(self, loss, start, end, keep, step=None, pred=None, scored=None):
+        """
+        set the loss of the candidates of images [start, end), sort them by loss (descending, stable)
+        and keep the top ones
+        loss: (num_candidates, end - start), the loss of each candidate of each image
+        step, pred: the model step and the predicted labels (num_candidates, end - start) of the scored candidates
+        scored: (num_candidates, end - start) bool, the candidates whose loss is computed at step (default all)
+        """
+        loss = np.asarray(loss, dtype=np.float64).T
+        num = loss.shape[1]
+        self.loss[start:end, :num] = loss
+        if step is not None:
+            scored = np.ones(loss.shape, dtype=bool) if scored is None else np.asarray(scored).T
+            self.step[start:end, :num][scored] = step
+            if pred is not None:
+                self.pred[start:end, :num][scored] = np.asarray(pred).T[scored]
+        order = np.argsort(-loss, axis=1, kind='mergesort')
+        rows = np.arange(end - start)[:, np.newaxis]
+        for column in (self.codes, self.loss, self.step, self.pred):
+            column[start:end, :num] = column[start:end, :num][rows, order]
+        self.length[start:end] = np.minimum(self.length[start:end], keep)
+
+    def nbytes(self):
+        return self.codes.nbytes + self.loss.nbytes + self.length.nbytes + self.step.nbytes + self.pred.nbytes
@@ -0,0 +1,95 @@
+"""
+This program is designed to generate the batches of augmented training data ahead of training
+A background thread generates the batches of an epoch in a shuffled order while the model trains on the former
+ones, the number of batches it runs ahead is bounded by the staleness of the model used to score the candidates.
+"""
+
+import threading
+import numpy as np
+
+
+class Prefetcher:
+    """
+    generate(index) the batches of an epoch on a background thread, the i-th requested batch is batch order[i]
+    staleness: batch i is generated once batch i - staleness is consumed, i.e., while the model trains on it,
+    so the candidates of a batch are scored with weights at most staleness training steps old
+    shuffle: draw a new order in each epoch, as keras shuffles a Sequence, which it requests in order when the
+    batches are prefetched (see DataGenerator.keras_workers)
+    """
+
+    def __init__(self, generate, num_batches, staleness=1, shuffle=True, seed=None):
+        self.generate = generate
+        self.num_batches = num_batches
+        self.staleness = max(1, staleness)
+        self.shuffle = shuffle
+        self.random = np.random.RandomState(seed)
+        self.order = np.arange(num_batches)
+        if shuffle:
+            self.random.shuffle(self.order)
+        self.cond = threading.Condition()
+        self.thread = None
+        self.batches = dict()
+        self.consumed = 0  # the index of the next batch to be consumed
+        self.stopped = False
+        self.error = None
+
+    def start(self, first):
+        """generate the batches from first to the end of the epoch"""
+        self.stop()
+        self.batches = dict()
+        self.consumed = first
+        self.stopped = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(first,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, first):
+        for index in range(first, self.num_batches):
+            with self.cond:
+                while not self.stopped and index - self.consumed >= self.staleness:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+            try:
+                batch = self.generate(self.order[index])
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.batches[index] = batch
+                self.cond.notify_all()
+
+    def get(self, index):
+        """the index-th batch of the epoch, the batches requested out of order are generated again from index"""
+        if self.thread is None or index != self.consumed:
+            self.start(index)
+        with self.cond:
+            while index not in self.batches and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                error, self.error = self.error, None
+                self.thread = None
+                raise error
+            self.consumed = index + 1
+            self.cond.notify_all()
+            return self.batches.pop(index)
+
+    def stop(self):
+        """stop generating, e.g., at the end of an epoch, the batches not consumed are dropped"""
+        if self.thread is None:
+            return
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.thread = None
+        self.batches = dict()
+
+    def end_epoch(self):
+        """stop generating and draw the order of the next epoch"""
+        self.stop()
+        if self.shuffle:
+            self.random.shuffle(self.order)
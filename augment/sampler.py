@@ -0,0 +1,92 @@
+"""
+This program is designed to sample the parameters of perturbations in blocks
+A numpy random generator draws the parameters of many images at once from the ranges in Config,
+and independent child streams make the sampling of parallel workers reproducible.
+"""
+
+import copy
+import numpy as np
+from config import ExperimentalConfig
+
+try:
+    from numpy.random import SeedSequence, default_rng
+except ImportError:  # numpy < 1.17, fall back to RandomState
+    SeedSequence = None
+
+
+class ParamSampler:
+    sampler = None
+
+    def __init__(self, seed=None):
+        config = ExperimentalConfig.gen_config()
+        self.enable_filters = config.enable_filters
+        self.ranges = [np.asarray(r) for r in (config.rotation_range, config.translate_range,
+                                               config.translate_range, config.shear_range, config.zoom_range,
+                                               config.blur_range, config.brightness_range, config.contrast_range)]
+        # rotation, translate, translate_v, shear, zoom, blur, brightness, contrast without filters
+        self.identity = [0, 0, 0, 0, 1, 0, 0, 1]
+
+        self.seed_seq = None
+        if SeedSequence is not None:
+            self.seed_seq = SeedSequence(seed)
+            self.rng = default_rng(self.seed_seq)
+        else:
+            self.rng = np.random.RandomState(seed)
+
+    @staticmethod
+    def shared():
+        """the sampler shared by all perturbators of this process, seeded by Config.seed"""
+        if ParamSampler.sampler is None:
+            ParamSampler.sampler = ParamSampler(ExperimentalConfig.gen_config().seed)
+        return ParamSampler.sampler
+
+    def copy(self):
+        """a sampler with its own ranges (e.g., set_rotation_range of Perturbator), drawing from the same stream"""
+        sampler = copy.copy(self)
+        sampler.ranges = list(self.ranges)
+        return sampler
+
+    def spawn(self, n):
+        """n independent child samplers with the same ranges, e.g., one per worker"""
+        children = []
+        if self.seed_seq is not None:
+            for seed_seq in self.seed_seq.spawn(n):
+                child = self.copy()
+                child.seed_seq = seed_seq
+                child.rng = default_rng(seed_seq)
+                children.append(child)
+        else:
+            for seed in self.integers(2**31 - 1, n):
+                child = self.copy()
+                child.rng = np.random.RandomState(seed)
+                children.append(child)
+        return children
+
+    def integers(self, high, size=None):
+        """uniform integers in [0, high)"""
+        if self.seed_seq is not None:
+            return self.rng.integers(0, high, size)
+        return self.rng.randint(0, high, size)
+
+    def subsets(self, n, k, size):
+        """(size, k) array, each row is k distinct values of range(n) in random order"""
+        if self.seed_seq is not None:
+            keys = self.rng.random((size, n))
+        else:
+            keys = self.rng.random_sample((size, n))
+        return np.argsort(keys, axis=1)[:, :k]
+
+    def columns(self, n):
+        """the parameters of n perturbations, one array per parameter"""
+        num_ranges = len(self.ranges) if self.enable_filters else 4
+        cols = [r[self.integers(len(r), n)] for r in self.ranges[:num_ranges]]
+        cols += [np.full(n, v) for v in self.identity[num_ranges:]]
+        return cols
+
+    def sample(self, n):
+        """(n, 8) array of (rotation, translate, translate_v, shear, zoom, blur, brightness, contrast)"""
+        return np.column_stack(self.columns(n)).astype(np.float64)
+
+    def sample_paras(self, n):
+        """the same as sample, but a list of tuples of python numbers (e.g., for fix_perturb_img)"""
+        return list(zip(*[col.tolist() for col in self.columns(n)]))
@@ -0,0 +1,99 @@
+"""
+This program is designed to score all candidates of a batch in one pass
+The candidates of all population members are predicted as one tensor in micro batches, whose size is tuned by
+timing the first calls, and the loss, predicted label and top-2 margin of every candidate are returned as matrices.
+"""
+
+import time
+import numpy as np
+from util import logger
+
+
+class Scorer:
+    """
+    model: the keras model, predicted with predict_on_batch
+    loss: loss(y_pred, y_true) of each row, on the predictions clipped to [1e-8, 1 - 1e-8]
+    micro_batch: the number of images per predict_on_batch (0: tuned among base * 1, 2, 4, 8)
+    graph: compute the loss, label and margin in the graph of the model (float32, clipped to the epsilon of keras)
+    instead of copying the predictions to the host
+    """
+
+    def __init__(self, model, loss, micro_batch=0, base=128, graph=False):
+        self.model = model
+        self.loss = loss
+        self.micro_batch = micro_batch
+        self.trials = [base * 2 ** k for k in range(4)]
+        self.timing = dict()  # seconds per image of each tried micro batch size
+        self.graph = graph
+        self.function = None
+
+    def graph_function(self):
+        """the backend function (images, one hot labels, learning phase) -> (loss, label, margin) of each image"""
+        import keras.backend as K
+        import tensorflow as tf
+        output = self.model.output
+        labels = K.placeholder(shape=K.int_shape(output), dtype=K.dtype(output))
+        prob = K.clip(output, K.epsilon(), 1 - K.epsilon())
+        loss = -K.sum(labels * K.log(prob) + (1 - labels) * K.log(1 - prob), axis=1)
+        top = tf.nn.top_k(output, k=min(2, K.int_shape(output)[-1]))[0]
+        margin = top[:, 0] - top[:, -1]
+        return K.function([self.model.input, labels, K.learning_phase()], [loss, K.argmax(output, axis=1), margin])
+
+    def host_score(self, x, y):
+        """the loss, label and margin of the predictions of x copied to the host as float64"""
+        y_pred = np.clip(np.array(self.model.predict_on_batch(x), dtype='float64'), 1e-8, 1 - 1e-8)
+        top = -np.sort(-y_pred, axis=1)[:, :2]
+        return self.loss(y_pred, y), np.argmax(y_pred, axis=1), top[:, 0] - top[:, -1]
+
+    def batch_size(self, m):
+        """the micro batch size of a call with m images"""
+        if self.micro_batch > 0:
+            return self.micro_batch
+        for size in self.trials:
+            if size not in self.timing:
+                if size <= max(m, self.trials[0]):
+                    return size
+                self.timing[size] = np.inf  # larger than the calls
+        self.micro_batch = min(self.timing, key=self.timing.get)
+        logger.info("micro batch size of scoring : " + str(self.micro_batch))
+        return self.micro_batch
+
+    def run(self, x, y):
+        """the loss, label and margin of x (m, ...) in micro batches"""
+        if self.graph and self.function is None:
+            self.function = self.graph_function()
+        score = self.host_score if self.function is None else lambda x_i, y_i: self.function([x_i, y_i, 0])
+        tuning = self.micro_batch <= 0
+        size = self.batch_size(len(x))
+        start = time.time()
+        try:
+            outputs = [score(x[i:i+size], y[i:i+size]) for i in range(0, len(x), size)]
+        except Exception:
+            if not tuning or size == self.trials[0]:
+                raise
+            logger.info("failed to predict with micro batch size " + str(size))  # e.g., out of memory
+            for larger in self.trials[self.trials.index(size):]:
+                self.timing[larger] = np.inf
+            return self.run(x, y)
+        if tuning and self.micro_batch <= 0 and len(x) >= size:
+            self.timing[size] = (time.time() - start) / len(x)
+        return [np.concatenate([output[k] for output in outputs]) for k in range(3)]
+
+    def score(self, x, y):
+        """
+        x: (m, ...) model inputs, y: (m, num_classes) one hot labels
+        return: the loss (m,), the predicted label (m,) and the margin of the top 2 probabilities (m,) of each image
+        """
+        if len(x) == 0:
+            return np.zeros(0), np.zeros(0, dtype=int), np.zeros(0)
+        loss, pred, margin = self.run(x, np.asarray(y, dtype='float32' if self.graph else 'float64'))
+        return loss, pred.astype(int), margin
+
+    def score_population(self, x, y):
+        """
+        x: (num_candidates, n, ...) model inputs of the candidates of n images, y: (n, num_classes)
+        return: the loss, the predicted labels and the top-2 margins, (num_candidates, n) each
+        """
+        num, n = x.shape[:2]
+        scores = self.score(x.reshape((num * n,) + x.shape[2:]), np.tile(y, (num, 1)))
+        return [s.reshape(num, n) for s in scores]
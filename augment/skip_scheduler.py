@@ -0,0 +1,77 @@
+"""
+This program is designed to schedule the samples skipped by selective augmentation
+A sample found robust in k full evaluations in a row is skipped for min(2^(k-1), max_epochs) epochs (exponential
+backoff), the top candidate of a skipped sample is still checked, and the sample re-enters augmentation once it is
+not robust anymore, while a random fraction of the skipped samples is audited, evaluated again before its skip
+expires.
+"""
+
+import numpy as np
+
+
+class SkipScheduler:
+    """
+    num: the number of samples
+    max_epochs: the longest skip after a full evaluation (0: no limit, 1: a robust sample is evaluated every other
+    epoch)
+    audit: the fraction of the skipped samples evaluated again in each epoch
+    """
+
+    def __init__(self, num, max_epochs=0, audit=0.0, seed=None):
+        self.max_epochs = max(0, max_epochs)
+        self.audit = audit
+        self.random = np.random.RandomState(seed)
+        self.epoch = 0
+        self.streak = np.zeros(num, dtype=np.uint8)  # the number of full evaluations in a row the sample is robust
+        self.until = np.zeros(num, dtype=np.int32)  # the sample is skipped in the epochs before until
+        self.skipped = np.zeros(num, dtype=bool)  # skipped in this epoch, updated in place
+        self.audited = 0
+        self.reentered = 0
+        self.judged = 0  # the evaluated samples found robust, whose prediction is checked
+        self.judged_correct = 0  # of which all candidates are predicted correctly
+
+    def observe(self, rows, robust, correct=None):
+        """
+        the robustness of samples rows in this epoch, the skipped ones are only checked on their top candidate,
+        the skip of a sample that is still robust is left as it is, one that is not robust anymore re-enters
+        augmentation in the next epoch, a robust full evaluation extends the streak and skips the next epochs
+        correct: whether all candidates of each sample are predicted correctly, i.e., the robust accuracy
+        """
+        rows = np.asarray(rows)
+        robust = np.asarray(robust, dtype=bool)
+        evaluated = ~self.skipped[rows]
+        if correct is not None:
+            self.judged += int(np.sum(robust & evaluated))
+            self.judged_correct += int(np.sum(robust & evaluated & np.asarray(correct, dtype=bool)))
+        self.reentered += int(np.sum(~robust & (self.streak[rows] > 0)))
+
+        streak = self.streak[rows].astype(np.int64)
+        streak = np.where(robust, np.where(evaluated, np.minimum(streak + 1, 255), streak), 0)
+        skip = 1 << (np.minimum(streak, 31) - 1).clip(0, 30)
+        if self.max_epochs > 0:
+            skip = np.minimum(skip, self.max_epochs)
+        until = np.where(evaluated, self.epoch + 1 + skip, self.until[rows])
+        self.streak[rows] = streak
+        self.until[rows] = np.where(robust, until, self.epoch + 1)
+
+    def end_epoch(self):
+        """
+        select the samples skipped in the next epoch, return the statistics of this epoch, the fraction of the
+        skipped samples, and the robust accuracy of the samples found robust (None if not checked)
+        """
+        stats = {"skipped": float(np.mean(self.skipped)) if len(self.skipped) else 0.0,
+                 "audited": self.audited, "reentered": self.reentered,
+                 "robust_acc": float(self.judged_correct) / self.judged if self.judged else None}
+        self.epoch += 1
+        self.skipped[...] = self.until > self.epoch
+        if self.audit > 0:
+            audit = self.skipped & (self.random.random_sample(len(self.skipped)) < self.audit)
+            self.skipped[audit] = False
+            self.audited = int(np.sum(audit))
+        self.reentered = 0
+        self.judged = 0
+        self.judged_correct = 0
+        return stats
+
+    def nbytes(self):
+        return self.streak.nbytes + self.until.nbytes + self.skipped.nbytes
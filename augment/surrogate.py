@@ -0,0 +1,63 @@
+"""
+This program is designed to estimate the loss of the children of the genetic algorithm without the DNN
+The loss of a child is estimated from the candidates evaluated on the same image recently, by its nearest
+neighbors in the parameter lattice, so that only the most promising children are scored by the model.
+"""
+
+import numpy as np
+from lattice import Lattice
+
+
+class Surrogate:
+    """
+    k nearest neighbor regression of the loss of each image, weighted by the inverse distance of the normalized
+    lattice indices, over a ring of the last history evaluations of the image
+    """
+
+    def __init__(self, num_images, history=32, neighbors=3, lattice=None):
+        self.lattice = lattice if lattice is not None else Lattice.shared()
+        self.neighbors = min(neighbors, history)
+        self.codes = np.zeros((num_images, history), dtype=np.int64)
+        self.loss = np.zeros((num_images, history))
+        self.count = np.zeros(num_images, dtype=np.int64)  # the number of evaluations of each image
+
+    def features(self, codes):
+        return self.lattice.unravel(codes) / np.maximum(self.lattice.sizes - 1, 1).astype(np.float64)
+
+    def observe(self, rows, codes, loss):
+        """record the loss (m,) of candidates codes (m,) of distinct images rows (m,)"""
+        slot = self.count[rows] % self.codes.shape[1]
+        self.codes[rows, slot] = codes
+        self.loss[rows, slot] = loss
+        self.count[rows] += 1
+
+    def predict(self, rows, codes):
+        """(n, k) estimated loss of candidates codes (n, k) of images rows (n,), nan without history"""
+        history = self.codes.shape[1]
+        diff = self.features(codes)[:, :, np.newaxis] - self.features(self.codes[rows])[:, np.newaxis]
+        dist = np.sqrt(np.sum(diff ** 2, axis=3))  # (n, k, history)
+        empty = np.arange(history) >= np.minimum(self.count[rows], history)[:, np.newaxis]
+        dist[np.broadcast_to(empty[:, np.newaxis], dist.shape)] = np.inf
+
+        nearest = np.argpartition(dist, self.neighbors - 1, axis=2)[:, :, :self.neighbors]
+        dist = np.take_along_axis(dist, nearest, axis=2)
+        loss = np.take_along_axis(np.broadcast_to(self.loss[rows][:, np.newaxis], nearest.shape[:2] + (history,)),
+                                  nearest, axis=2)
+        weight = np.where(np.isinf(dist), 0, 1 / (dist + 1e-6))
+        with np.errstate(invalid='ignore'):
+            return np.sum(weight * loss, axis=2) / np.sum(weight, axis=2)
+
+    def screen(self, rows, codes, keep):
+        """
+        select the keep candidates of each image with the highest estimated loss, all of an image without history
+        return: (n, k) bool of the selected candidates, (n, k) estimated loss (nan if unknown)
+        """
+        estimate = self.predict(rows, codes)
+        order = np.argsort(-np.where(np.isnan(estimate), np.inf, estimate), axis=1, kind='mergesort')
+        selected = np.zeros(codes.shape, dtype=bool)
+        selected[np.arange(len(codes))[:, np.newaxis], order[:, :keep]] = True
+        selected[self.count[rows] == 0] = True
+        return selected, estimate
+
+    def nbytes(self):
+        return self.codes.nbytes + self.loss.nbytes + self.count.nbytes
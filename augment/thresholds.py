@@ -0,0 +1,51 @@
+"""
+This program is designed to calibrate the robust threshold of each class online
+The threshold of a class is the quantile of the recent robustness loss of all the samples of the class (the max loss
+of the candidates of the evaluated samples, the loss of the top candidate of the skipped ones), so that about the
+target fraction of the samples of every class is robust, whatever the scale of the loss of the class. Fitted on
+the evaluated samples only, whose loss is higher as the robust ones are skipped, the threshold would keep rising.
+"""
+
+import numpy as np
+
+
+class ClassThresholds:
+    """
+    quantile: the target fraction of robust (skipped) samples of each class
+    history: the number of recent losses of each class kept
+    default: the threshold of a class with less than min_count losses
+    """
+
+    def __init__(self, num_classes, quantile, history=256, default=1e-4, min_count=16):
+        self.quantile = quantile
+        self.min_count = min(min_count, history)
+        self.loss = np.full((num_classes, history), np.nan, dtype=np.float32)
+        self.count = np.zeros(num_classes, dtype=np.int64)
+        self.value = np.full(num_classes, default)
+
+    def __call__(self, labels):
+        """the threshold of each sample of labels"""
+        return self.value[labels]
+
+    def observe(self, labels, loss):
+        """record the robustness loss of samples of labels, and update the threshold of their classes"""
+        if len(labels) == 0:
+            return
+        order = np.argsort(labels, kind='mergesort')
+        labels = np.asarray(labels)[order]
+        first = np.searchsorted(labels, labels)
+        slot = (self.count[labels] + np.arange(len(labels)) - first) % self.loss.shape[1]
+        self.loss[labels, slot] = np.asarray(loss)[order]
+
+        classes, counts = np.unique(labels, return_counts=True)
+        self.count[classes] += counts
+        ready = classes[self.count[classes] >= self.min_count]
+        if len(ready):
+            self.value[ready] = np.nanquantile(self.loss[ready], self.quantile, axis=1)
+
+    def summary(self):
+        """the min, median and max thresholds of the calibrated classes"""
+        ready = self.value[self.count >= self.min_count]
+        if len(ready) == 0:
+            return None
+        return float(np.min(ready)), float(np.median(ready)), float(np.max(ready))
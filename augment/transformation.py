@@ -1,6 +1,7 @@
-import random
 import numpy as np
 from config import ExperimentalConfig
+from sampler import ParamSampler
+from lattice import Lattice
 
 
 class Transformation:
@@ -61,160 +62,141 @@ class Transformation:
         contrast = 2 - self.contrast
         return rotation, translate, translate_v, shear, zoom, blur, brightness, contrast
 
-    def crossover(self, item2, existing_trs, loss):
-        if loss < 1e-3:
-            self.config.translation_step['rotation'] = 12
-            self.config.translation_step['shear'] = 0.04
-        else:
-            self.config.translation_step['rotation'] = 6
-            self.config.translation_step['shear'] = 0.02
-
-        mutated_params = []
-        if self.config.enable_filters:
-            choice = random.sample(range(1, 126), self.config.popsize)  # 0000001 - 1111110
-        else:
-            if self.config.popsize > 13:
-                choice = random.sample(range(1, 14), 13)   # 0001 - 1110
-                for i in range(0, self.config.popsize-13):
-                    choice.append(0)
-            else:
-                choice = random.sample(range(1, 14), self.config.popsize)   # 0001 - 1110
-
-        for i in choice:
-            rotation, translate, translate_v, shear, zoom, blur, brightness, contrast = self.get_paras()
-            ids = format(i, '#010b')
-            if ids[-1] == '1':
-                rotation = item2.rotation
-            if ids[-2] == '1':
-                translate = item2.translate
-            if ids[-3] == '1':
-                translate_v = item2.translate_v
-            if ids[-4] == '1':
-                shear = item2.shear
-            if self.config.enable_filters:
-                if ids[-5] == '1':
-                    brightness = item2.brightness
-                if ids[-6] == '1':
-                    contrast = item2.contrast
-                if ids[-7] == '1':
-                    zoom = item2.zoom
-                # if ids[-7] == '1':
-                #     blur = item2.blur
-            tr = Transformation(rotation, translate, translate_v, shear, zoom, blur, brightness, contrast)
-            if tr in existing_trs:
-                tr = self.mutate_node(tr, existing_trs)
-            existing_trs.append(tr)
-            mutated_params.append(tr)
-
-        return mutated_params
-
-    def mutate(self, existing_trs, loss):
-        if loss < 1e-3:
-            self.config.translation_step['rotation'] = 12
-            self.config.translation_step['shear'] = 0.04
-        else:
-            self.config.translation_step['rotation'] = 6
-            self.config.translation_step['shear'] = 0.02
 
-        mutated_params = []
-        for i in range(self.config.popsize):
-            tr = self.mutate_node(self, existing_trs)
-            mutated_params.append(tr)
-            existing_trs.append(tr)
+# the column of each mutated field in the parameters (rotation, translate, translate_v, shear, zoom, blur,
+# brightness, contrast), fields 4 - 6 (brightness, contrast, zoom) are only mutated with filters
+FIELD_COLUMNS = [0, 1, 2, 3, 6, 7, 4]
 
-        return mutated_params
 
-    def mutate_node(self, cur_tr, existing_trs):
-        for i in range(10):
-            new_tr = self.generate_mutated_node(cur_tr)
-            if new_tr not in existing_trs:
-                return new_tr
-        return cur_tr
-
-    def generate_mutated_node(self, cur_tr):
-        rotation, translate, translate_v, shear, zoom, blur, brightness, contrast = cur_tr.get_paras()
+class BatchOperator:
+    """
+    mutation and crossover of the top candidates of a batch of images in one set of numpy operations
+    the candidates are lattice codes (see lattice.py), as stored in Population.codes
+    visited: optional VisitedTable, candidates visited in former generations are not generated again
+    """
 
+    def __init__(self, sampler=None, lattice=None, visited=None):
+        self.config = ExperimentalConfig.gen_config()
+        self.sampler = sampler if sampler is not None else ParamSampler.shared()
+        self.lattice = lattice if lattice is not None else Lattice.shared()
+        self.visited = visited
+        self.num_fields = 7 if self.config.enable_filters else 4
+        self.num_choices = 4 if self.config.enable_filters else 2
+        self.columns = FIELD_COLUMNS[:self.num_fields]
+
+        step = self.config.translation_step
+        field_ranges = [self.config.rotation_range, self.config.translate_range, self.config.translate_range,
+                        self.config.shear_range, self.config.brightness_range, self.config.contrast_range,
+                        self.config.zoom_range]
+        self.steps = np.array([step["rotation"], step["translate"], step["translate"], step["shear"],
+                               step["brightness"], step["contrast"], step["zoom"]], dtype=np.float64)
+        self.low = np.array([min(r) for r in field_ranges], dtype=np.float64)
+        self.high = np.array([max(r) for r in field_ranges], dtype=np.float64)
+        # flip: x -> center - x, i.e., negate the geometric parameters, 2 - x for contrast and zoom
+        self.flip_center = np.array([0, 0, 0, 0, 0, 2, 2], dtype=np.float64)
+
+    def field_steps(self, loss):
+        """(n, 7) mutation step of each field, the rotation and shear steps are doubled if loss < 1e-3"""
+        steps = np.tile(self.steps, (len(loss), 1))
+        steps[np.asarray(loss) < 1e-3, 0] *= 2
+        steps[np.asarray(loss) < 1e-3, 3] *= 2
+        return steps
+
+    def mutate_nodes(self, cur, steps):
+        """
+        one random mutation of each row of parameters cur (m, 8), the same as generate_mutated_node of the old
+        Transformation
+        steps: (m, 7), the mutation step of each field of each row
+        """
+        m = len(cur)
+        selected = np.zeros((m, 7), dtype=bool)
+        selected[np.arange(m)[:, np.newaxis], self.sampler.subsets(self.num_fields, self.num_choices, m)] = True
+        if self.config.enable_optimize:
+            selected[:, 1:3] = True
+        up_down = self.sampler.integers(3, (m, 7))  # up, down or flip
+
+        new = cur.copy()
+        for f, col in enumerate(self.columns):
+            value = cur[:, col]
+            up = np.clip(value + steps[:, f], self.low[f], self.high[f])
+            down = np.clip(value - steps[:, f], self.low[f], self.high[f])
+            mutated = np.choose(up_down[:, f], [up, down, self.flip_center[f] - value])
+            new[:, col] = np.where(selected[:, f], mutated, value)
+        return new
+
+    def known(self, rows, candidates, existing):
+        """
+        (n, k) bool, whether each of the candidates (n, k) is one of the existing ones (n, l) of its row,
+        or is visited by its image in rows (n,)
+        """
+        known = (candidates[:, :, np.newaxis] == existing[:, np.newaxis, :]).any(axis=2)
+        if self.visited is not None:
+            known |= self.visited.contains(rows, candidates)
+        return known
+
+    def mutate_unique(self, cur, existing, steps, rows, tries=10):
+        """
+        mutate each of the codes cur (n,) into a candidate not in existing (n, l),
+        the first of tries mutations that is new, cur itself if all of them are known
+        """
+        n = len(cur)
+        tried = self.mutate_nodes(np.repeat(self.lattice.decode(cur), tries, axis=0), np.repeat(steps, tries, axis=0))
+        tried = self.lattice.encode(tried).reshape(n, tries)
+        new = ~self.known(rows, tried, existing)
+        first = np.argmax(new, axis=1)
+        return np.where(new.any(axis=1), tried[np.arange(n), first], cur)
+
+    def mutate(self, existing, loss, rows):
+        """
+        popsize children of the top candidate of each row by mutation
+        existing: (n, l), the candidates of each image sorted by loss
+        loss: (n,), the loss of the top candidates
+        rows: (n,), the index of each image
+        return: (n, popsize)
+        """
+        steps = self.field_steps(loss)
+        children = []
+        for _ in range(self.config.popsize):
+            child = self.mutate_unique(existing[:, 0], existing, steps, rows)
+            children.append(child)
+            existing = np.concatenate([existing, child[:, np.newaxis]], axis=1)
+        return np.stack(children, axis=1)
+
+    def crossover_masks(self, n):
+        """(n, popsize, 7) bool, the fields of each child taken from the second parent"""
+        popsize = self.config.popsize
         if self.config.enable_filters:
-            choice = random.sample(range(0, 7), 4)
+            choice = self.sampler.subsets(125, popsize, n) + 1  # 0000001 - 1111101
+        elif popsize > 13:
+            choice = np.concatenate([self.sampler.subsets(13, 13, n) + 1,  # 0001 - 1101
+                                     np.zeros((n, popsize - 13), dtype=int)], axis=1)
         else:
-            choice = random.sample(range(0, 4), 2)
-
-        if 0 in choice:
-            up_down_choice = random.choice([0, 1, 2])
-            if up_down_choice == 0:
-                rotation = self.fit_range(rotation + self.config.translation_step["rotation"],
-                                          min(self.config.rotation_range), max(self.config.rotation_range))
-            elif up_down_choice == 1:
-                rotation = self.fit_range(rotation - self.config.translation_step["rotation"],
-                                          min(self.config.rotation_range), max(self.config.rotation_range))
-            else:
-                rotation *= -1
-
-        if 1 in choice or self.config.enable_optimize:
-            up_down_choice = random.choice([0, 1, 2])
-            if up_down_choice == 0:
-                translate = self.fit_range(translate + self.config.translation_step["translate"],
-                                           min(self.config.translate_range), max(self.config.translate_range))
-            elif up_down_choice == 1:
-                translate = self.fit_range(translate - self.config.translation_step["translate"],
-                                           min(self.config.translate_range), max(self.config.translate_range))
-            else:
-                translate *= -1
-
-        if 2 in choice or self.config.enable_optimize:
-            up_down_choice = random.choice([0, 1, 2])
-            if up_down_choice == 0:
-                translate_v = self.fit_range(translate_v + self.config.translation_step["translate"],
-                                             min(self.config.translate_range), max(self.config.translate_range))
-            elif up_down_choice == 1:
-                translate_v = self.fit_range(translate_v - self.config.translation_step["translate"],
-                                             min(self.config.translate_range), max(self.config.translate_range))
-            else:
-                translate_v *= -1
-
-        if 3 in choice:
-            up_down_choice = random.choice([0, 1, 2])
-            if up_down_choice == 0:
-                shear = self.fit_range(shear + self.config.translation_step["shear"],
-                                       min(self.config.shear_range), max(self.config.shear_range))
-            elif up_down_choice == 1:
-                shear = self.fit_range(shear - self.config.translation_step["shear"],
-                                       min(self.config.shear_range), max(self.config.shear_range))
-            else:
-                shear *= -1
-
-        if self.config.enable_filters:
-            if 4 in choice:
-                up_down_choice = random.choice([0, 1, 2])
-                if up_down_choice == 0:
-                    brightness = self.fit_range(brightness + self.config.translation_step["brightness"],
-                                                min(self.config.brightness_range), max(self.config.brightness_range))
-                elif up_down_choice == 1:
-                    brightness = self.fit_range(brightness - self.config.translation_step["brightness"],
-                                                min(self.config.brightness_range), max(self.config.brightness_range))
-                else:
-                    brightness *= -1
-
-            if 5 in choice:
-                up_down_choice = random.choice([0, 1, 2])
-                if up_down_choice == 0:
-                    contrast = self.fit_range(contrast + self.config.translation_step["contrast"],
-                                              min(self.config.contrast_range), max(self.config.contrast_range))
-                elif up_down_choice == 1:
-                    contrast = self.fit_range(contrast - self.config.translation_step["contrast"],
-                                              min(self.config.contrast_range), max(self.config.contrast_range))
-                else:
-                    contrast = 2 - contrast
-
-            if 6 in choice:
-                up_down_choice = random.choice([0, 1, 2])
-                if up_down_choice == 0:
-                    zoom = self.fit_range(zoom + self.config.translation_step["zoom"],
-                                          min(self.config.zoom_range), max(self.config.zoom_range))
-                elif up_down_choice == 1:
-                    zoom = self.fit_range(zoom - self.config.translation_step["zoom"],
-                                          min(self.config.zoom_range), max(self.config.zoom_range))
-                else:
-                    zoom = 2 - zoom
-
-        return Transformation(rotation, translate, translate_v, shear, zoom, blur, brightness, contrast)
+            choice = self.sampler.subsets(13, popsize, n) + 1  # 0001 - 1101
+        return (choice[:, :, np.newaxis] >> np.arange(7)) & 1 == 1
+
+    def crossover(self, existing, second, loss, rows):
+        """
+        popsize children of the top candidate and a second parent of each row by crossover,
+        a child that is already known is mutated
+        existing: (n, l), the candidates of each image sorted by loss
+        second: (n,), the second parent of each image
+        loss: (n,), the loss of the top candidates
+        rows: (n,), the index of each image
+        return: (n, popsize)
+        """
+        steps = self.field_steps(loss)
+        top = self.lattice.decode(existing[:, 0])
+        second = self.lattice.decode(second)
+        masks = self.crossover_masks(len(top))
+        children = []
+        for c in range(self.config.popsize):
+            child = top.copy()
+            for f, col in enumerate(self.columns):
+                child[:, col] = np.where(masks[:, c, f], second[:, col], top[:, col])
+            child = self.lattice.encode(child)
+            dup = np.nonzero(self.known(rows, child[:, np.newaxis], existing)[:, 0])[0]
+            if len(dup):
+                child[dup] = self.mutate_unique(child[dup], existing[dup], steps[dup], rows[dup])
+            children.append(child)
+            existing = np.concatenate([existing, child[:, np.newaxis]], axis=1)
+        return np.stack(children, axis=1)
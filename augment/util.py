@@ -16,6 +16,7 @@ class SAU(Enum):
     replace_worst_of_10 = 6
     ga_loss = 8
     ga_cov = 9
+    successive_halving = 10
 
     @staticmethod
     def list():
@@ -0,0 +1,96 @@
+"""
+This program is designed to cache the sampling maps of geometric perturbations
+Each parameter range in Config is a small discrete set, so the same warps are computed again and again.
+The cache keeps the cv2.remap maps of recently used warps and evicts the least recently used ones.
+"""
+
+from collections import OrderedDict
+import threading
+import numpy as np
+import cv2
+from libs.spacial_transformation import geometric_matrix, resize_matrix
+
+
+class WarpCache:
+    cache = None
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.maps = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def shared(max_bytes=256 * 1024 * 1024):
+        """the cache shared by all perturbators of this process"""
+        if WarpCache.cache is None:
+            WarpCache.cache = WarpCache(max_bytes)
+        return WarpCache.cache
+
+    @staticmethod
+    def key(shape, angle=0, translation=0, translation_v=0, shear=0, zoom=1, dsize=None, preprocess=None):
+        # round the parameters, since mutated parameters (e.g., 0.1 - 0.02) are not exact, the maps only depend on
+        # the resample of preprocess (see AffinePreprocess.matrix), not on the object or its scale and offset
+        resample = None if preprocess is None else (tuple(preprocess.dsize), bool(preprocess.center_crop))
+        return (tuple(shape[:2]), round(angle, 6), round(translation, 6), round(translation_v, 6),
+                round(shear, 6), round(zoom, 6), None if dsize is None else tuple(dsize), resample)
+
+    @staticmethod
+    def build_maps(shape, angle=0, translation=0, translation_v=0, shear=0, zoom=1, dsize=None, preprocess=None):
+        """generate the fixed-point remap maps of a geometric perturbation (see image_geometric_fused)"""
+        M, size = geometric_matrix(shape, angle, translation, translation_v, shear, zoom)
+        if preprocess is not None:
+            M = preprocess.matrix(size).dot(M)
+            size = preprocess.dsize
+        elif dsize is not None:
+            M = resize_matrix(size, dsize).dot(M)
+            size = tuple(dsize)
+        inv = np.linalg.inv(M)[:2].astype(np.float32)
+        grid = np.dstack(np.meshgrid(np.arange(size[0], dtype=np.float32),
+                                     np.arange(size[1], dtype=np.float32)))
+        return cv2.convertMaps(cv2.transform(grid, inv), None, cv2.CV_16SC2)
+
+    def get(self, shape, angle=0, translation=0, translation_v=0, shear=0, zoom=1, dsize=None, preprocess=None):
+        key = self.key(shape, angle, translation, translation_v, shear, zoom, dsize, preprocess)
+        with self.lock:
+            maps = self.maps.pop(key, None)
+            if maps is not None:
+                self.hits += 1
+                self.maps[key] = maps  # move to the most recently used end
+                return maps
+            self.misses += 1
+
+        # generate the maps outside the lock, so that perturbation workers are not serialized
+        maps = self.build_maps(shape, angle, translation, translation_v, shear, zoom, dsize, preprocess)
+        size = maps[0].nbytes + maps[1].nbytes
+        if size > self.max_bytes:
+            return maps
+        with self.lock:
+            if key in self.maps:  # generated by another worker in the meantime
+                return maps
+            while self.nbytes + size > self.max_bytes:
+                _, evicted = self.maps.popitem(last=False)
+                self.nbytes -= evicted[0].nbytes + evicted[1].nbytes
+                self.evictions += 1
+            self.maps[key] = maps
+            self.nbytes += size
+        return maps
+
+    def warp(self, img, angle=0, translation=0, translation_v=0, shear=0, zoom=1, dsize=None, preprocess=None):
+        """the same as image_geometric_fused, but reuses the cached maps"""
+        map1, map2 = self.get(img.shape, angle, translation, translation_v, shear, zoom, dsize, preprocess)
+        return cv2.remap(img, map1, map2, cv2.INTER_LINEAR)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.maps), "bytes": self.nbytes,
+                "hit_rate": self.hits / float(total) if total > 0 else 0}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
@@ -13,6 +13,7 @@ import os
 import copy
 from augment.data_generator import DataGenerator
 from augment.util import logger
+from libs.preprocess import AffinePreprocess
 import cv2
 import numpy as np
 from keras.layers import Conv2D, Dense, Input, add, Activation, GlobalAveragePooling2D, AveragePooling2D
@@ -333,6 +334,13 @@ class Cifar10Model:
         imgs = self.normalization(imgs)
         return imgs
 
+    def affine_preprocess(self):
+        """preprocess_original_imgs declared as an affine resample and a per-channel scale and offset"""
+        # the same mean and std as normalization
+        mean = np.array([125.307, 122.95, 113.865])
+        std = np.array([62.9932, 62.0887, 66.7048])
+        return AffinePreprocess(self.input_shape, scale=1 / std, offset=-mean / std, center_crop=True)
+
     def scheduler(self, epoch):
         epoch += self.start_point
         if epoch < 81:
@@ -388,6 +396,7 @@ class Cifar10Model:
             model.load_weights(weights_file)
 
         x_val = self.preprocess_original_imgs(x_val)
+        fit_model, x_val = DataGenerator.input_model(self, model, x_val, train_strategy)
         if train_strategy is None:
             x_train = self.preprocess_original_imgs(x_train)
             self.datagen_rotation.fit(x_train)
@@ -400,13 +409,14 @@ class Cifar10Model:
             #           callbacks=callbacks_list)
         else:
             graph = tf.get_default_graph()
-            data = DataGenerator(self, model, x_train, y_train, self.batch_size, train_strategy, graph)
-
-        model.fit_generator(data,
-                            steps_per_epoch=len(x_train)/self.batch_size,
-                            validation_data=(x_val, y_val),
-                            epochs=self.epoch, verbose=1, #workers=4,
-                            callbacks=callbacks_list)
+            data = DataGenerator(self, fit_model, x_train, y_train, self.batch_size, train_strategy, graph)
+
+        fit_model.fit_generator(data,
+                                steps_per_epoch=len(x_train)/self.batch_size,
+                                validation_data=(x_val, y_val),
+                                epochs=self.epoch, verbose=1, #workers=4,
+                                workers=DataGenerator.keras_workers(),
+                                callbacks=callbacks_list)
         return model
 
     def load_model(self, model_id=0, weights_file='cifar10.hdf5'):
@@ -22,7 +22,8 @@ import tensorflow as tf
 import cv2
 from augment.data_generator import DataGenerator
 from augment.util import logger
-from augment.config import ExperimentalConfig
+from config import ExperimentalConfig
+from libs.preprocess import AffinePreprocess
 from keras.datasets import mnist, fashion_mnist
 from keras.constraints import maxnorm
 from keras.layers.normalization import BatchNormalization
@@ -82,6 +83,10 @@ class FashionMnist:
         else:
             return np.array(x).astype('float32') / 255.
 
+    def affine_preprocess(self):
+        """preprocess_original_imgs declared as an affine resample and a per-channel scale and offset"""
+        return AffinePreprocess(self.input_shape, scale=1 / 255.)
+
     def load_original_test_data(self):
         y_test = keras.utils.to_categorical(self.y_test, self.num_classes)
         return list(self.x_test), y_test
@@ -234,6 +239,7 @@ class FashionMnist:
                                      save_best_only=False, mode='max')
         callbacks_list = [checkpoint]
         x_val = self.preprocess_original_imgs(x_val)
+        fit_model, x_val = DataGenerator.input_model(self, model, x_val, train_strategy)
         '''
         if train_strategy is None:
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
@@ -246,13 +252,14 @@ class FashionMnist:
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
         else:
             graph = tf.get_default_graph()
-            data = DataGenerator(self, model, x_train, y_train, batch_size, train_strategy, graph)
-
-        model.fit_generator(data,
-                            steps_per_epoch=len(x_train) / self.batch_size,
-                            validation_data=(x_val, y_val),
-                            epochs=epochs, verbose=1,
-                            callbacks=callbacks_list)
+            data = DataGenerator(self, fit_model, x_train, y_train, batch_size, train_strategy, graph)
+
+        fit_model.fit_generator(data,
+                                steps_per_epoch=len(x_train) / self.batch_size,
+                                validation_data=(x_val, y_val),
+                                epochs=epochs, verbose=1,
+                                workers=DataGenerator.keras_workers(),
+                                callbacks=callbacks_list)
         return model
 
     def load_model(self, model_id=0, weights_file='gtsrb.hdf5'):
@@ -22,7 +22,8 @@ import tensorflow as tf
 import cv2
 from augment.data_generator import DataGenerator
 from augment.util import logger
-from augment.config import ExperimentalConfig
+from config import ExperimentalConfig
+from libs.preprocess import AffinePreprocess
 import torch
 
 
@@ -344,6 +345,10 @@ class GtsrbModel:
         imgs = np.array(imgs, dtype='float32')
         return imgs
 
+    def affine_preprocess(self):
+        """preprocess_original_imgs declared as an affine resample and a per-channel scale and offset"""
+        return AffinePreprocess(self.input_shape)
+
     def mixup(self, x_pre_mix, y_pre_mix, alpha=1.0):
         """ Returns mixed inputs, pairs of targets, and lambda """
         if alpha > 0:
@@ -387,6 +392,7 @@ class GtsrbModel:
         # callbacks_list = [checkpoint, lr_reducer, lr_scheduler]
 
         x_val = self.preprocess_original_imgs(x_val)
+        fit_model, x_val = DataGenerator.input_model(self, model, x_val, train_strategy)
 
         # if train_strategy is not None:
         #     selector = Selector(model, train_strategy)
@@ -403,14 +409,15 @@ class GtsrbModel:
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
         else:
             graph = tf.get_default_graph()
-            data = DataGenerator(self, model, x_train, y_train, batch_size, train_strategy, graph)
+            data = DataGenerator(self, fit_model, x_train, y_train, batch_size, train_strategy, graph)
             
         # if model_id == 0:
-        model.fit_generator(data,
-                            validation_data=(x_val, y_val),
-                            epochs=epochs, verbose=1,
-                            steps_per_epoch=len(x_train)/self.batch_size,
-                            callbacks=callbacks_list)
+        fit_model.fit_generator(data,
+                                validation_data=(x_val, y_val),
+                                epochs=epochs, verbose=1,
+                                steps_per_epoch=len(x_train)/self.batch_size,
+                                workers=DataGenerator.keras_workers(),
+                                callbacks=callbacks_list)
         # elif model_id == 1:
         #      for layer in model.layers:
         #          layer.trainable = True
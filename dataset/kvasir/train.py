@@ -22,7 +22,8 @@ import tensorflow as tf
 import cv2
 from augment.data_generator import DataGenerator
 from augment.util import logger
-from augment.config import ExperimentalConfig
+from config import ExperimentalConfig
+from libs.preprocess import AffinePreprocess
 from keras.regularizers import l1, l2
 from keras.applications.mobilenet import MobileNet
 from keras.optimizers import Nadam
@@ -275,6 +276,11 @@ class KvasirModel:
         imgs = np.array(imgs, dtype='float32')/255
         return imgs
 
+    def affine_preprocess(self):
+        """preprocess_original_imgs declared as an affine resample and a per-channel scale and offset"""
+        # transform.resize scales the images to [0, 1] before the division by 255
+        return AffinePreprocess(self.input_shape, scale=1 / 255. / 255.)
+
     def mixup(self, x_pre_mix, y_pre_mix, alpha=1.0):
         """ Returns mixed inputs, pairs of targets, and lambda """
         if alpha > 0:
@@ -315,19 +321,21 @@ class KvasirModel:
         # callbacks_list = [checkpoint, lr_reducer, lr_scheduler]
 
         x_val = self.preprocess_original_imgs(x_val)
+        fit_model, x_val = DataGenerator.input_model(self, model, x_val, train_strategy)
 
         if train_strategy is None:
             x_train = self.preprocess_original_imgs(x_train)
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
         else:
             graph = tf.get_default_graph()
-            data = DataGenerator(self, model, x_train, y_train, batch_size, train_strategy, graph)
-
-        model.fit_generator(data,
-                            validation_data=(x_val, y_val),
-                            epochs=epochs, verbose=1,
-                            steps_per_epoch=len(x_train) / self.batch_size,
-                            callbacks=callbacks_list)
+            data = DataGenerator(self, fit_model, x_train, y_train, batch_size, train_strategy, graph)
+
+        fit_model.fit_generator(data,
+                                validation_data=(x_val, y_val),
+                                epochs=epochs, verbose=1,
+                                steps_per_epoch=len(x_train) / self.batch_size,
+                                workers=DataGenerator.keras_workers(),
+                                callbacks=callbacks_list)
 
         return model
 
@@ -13,7 +13,8 @@ from keras.layers.normalization import BatchNormalization
 from keras.preprocessing import image
 from augment.data_generator import DataGenerator
 from augment.util import logger
-from augment.config import ExperimentalConfig
+from config import ExperimentalConfig
+from libs.preprocess import AffinePreprocess
 import tensorflow as tf
 from keras import backend as k
 from keras.preprocessing.image import ImageDataGenerator
@@ -82,6 +83,10 @@ class SVHN:
             x[i] = cv2.resize(x[i], (self.image_size, self.image_size))
         return np.array(x)
 
+    def affine_preprocess(self):
+        """preprocess_original_imgs declared as an affine resample and a per-channel scale and offset"""
+        return AffinePreprocess(self.input_shape)
+
     # load svhn data from the specified folder
     def load_svhn_data(self, path):
         f1 = h5py.File(path+'/train.hdf5', 'r')
@@ -202,6 +207,7 @@ class SVHN:
                                                      save_best_only=False, mode='max')
         callbacks_list = [checkpoint]
         x_val = self.preprocess_original_imgs(x_val)
+        fit_model, x_val = DataGenerator.input_model(self, model, x_val, train_strategy)
         '''
         if train_strategy is None:
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
@@ -214,13 +220,14 @@ class SVHN:
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
         else:
             graph = tf.get_default_graph()
-            data = DataGenerator(self, model, x_train, y_train, batch_size, train_strategy, graph)
-
-        model.fit_generator(data,
-                            steps_per_epoch=len(x_train) / self.batch_size,
-                            validation_data=(x_val, y_val),
-                            epochs=epochs, verbose=1,
-                            callbacks=callbacks_list)
+            data = DataGenerator(self, fit_model, x_train, y_train, batch_size, train_strategy, graph)
+
+        fit_model.fit_generator(data,
+                                steps_per_epoch=len(x_train) / self.batch_size,
+                                validation_data=(x_val, y_val),
+                                epochs=epochs, verbose=1,
+                                workers=DataGenerator.keras_workers(),
+                                callbacks=callbacks_list)
         return model
 
     def load_model(self, model_id=0, weights_file='svhn.hdf5'):
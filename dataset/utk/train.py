@@ -18,7 +18,8 @@ import tensorflow as tf
 import cv2
 from augment.data_generator import DataGenerator
 from augment.util import logger
-from augment.config import ExperimentalConfig
+from config import ExperimentalConfig
+from libs.preprocess import AffinePreprocess
 import h5py
 from keras.layers import Conv2D, MaxPooling2D, BatchNormalization
 from keras.utils.training_utils import multi_gpu_model
@@ -181,6 +182,10 @@ class UTKModel:
         imgs = np.array(imgs, dtype='float32')
         return imgs
 
+    def affine_preprocess(self):
+        """preprocess_original_imgs declared as an affine resample and a per-channel scale and offset"""
+        return AffinePreprocess(self.input_shape)
+
     def train_dnn_model(self, _model=[0, "models/gtsrb"], x_train=None, y_train=None,
                         x_val=None, y_val=None, train_strategy=None):
         """
@@ -204,20 +209,22 @@ class UTKModel:
         callbacks_list = [checkpoint]
 
         x_val = self.preprocess_original_imgs(x_val)
+        fit_model, x_val = DataGenerator.input_model(self, model, x_val, train_strategy)
 
         if train_strategy is None:
             x_train = self.preprocess_original_imgs(x_train)
             data = self.datagen_rotation.flow(x_train, y_train, batch_size=batch_size)
         else:
             graph = tf.get_default_graph()
-            data = DataGenerator(self, model, x_train, y_train, batch_size, train_strategy, graph)
+            data = DataGenerator(self, fit_model, x_train, y_train, batch_size, train_strategy, graph)
 
         # if model_id == 0:
-        model.fit_generator(data,
-                            steps_per_epoch=len(self.x_train)/self.batch_size,
-                            validation_data=(x_val, y_val),
-                            epochs=epochs, verbose=1,
-                            callbacks=callbacks_list)
+        fit_model.fit_generator(data,
+                                steps_per_epoch=len(self.x_train)/self.batch_size,
+                                validation_data=(x_val, y_val),
+                                epochs=epochs, verbose=1,
+                                workers=DataGenerator.keras_workers(),
+                                callbacks=callbacks_list)
         # elif model_id == 1:
         #      for layer in model.layers:
         #          layer.trainable = True
@@ -0,0 +1,69 @@
+"""
+This program is designed to declare the preprocessing of a dataset (preprocess_original_imgs) as an affine
+resample followed by a per-channel scale and offset, so that the resample can be merged into the perturbation warp
+"""
+
+import numpy as np
+import cv2
+from libs.spacial_transformation import resize_matrix, center_crop_matrix
+
+
+class AffinePreprocess:
+    """
+    model input = resample(img) * scale + offset
+    shape: the input shape of the model, (rows, cols[, ch])
+    scale, offset: scalars or per-channel values
+    center_crop: crop the central square of the image before resizing
+    """
+
+    def __init__(self, shape, scale=1.0, offset=0.0, center_crop=False, dtype='float32'):
+        self.shape = tuple(shape)
+        self.dsize = (self.shape[1], self.shape[0])
+        self.dtype = np.dtype(dtype)
+        self.scale = np.asarray(scale, dtype=self.dtype)
+        self.offset = np.asarray(offset, dtype=self.dtype)
+        self.center_crop = center_crop
+
+    def matrix(self, size):
+        """the affine matrix from an image of size (cols, rows) to the model input"""
+        M = np.eye(3)
+        if self.center_crop:
+            M, size = center_crop_matrix(size)
+        return resize_matrix(size, self.dsize).dot(M)
+
+    def allocate(self, n):
+        return np.empty((n,) + self.shape, dtype=self.dtype)
+
+    def normalize(self, imgs, out):
+        """scale and offset resampled images (one image or a batch) into out"""
+        np.multiply(imgs.reshape(out.shape), self.scale, out=out)
+        out += self.offset
+        return out
+
+    def resample_only(self):
+        """the same resample without scale and offset, i.e., the model input kept as uint8 images"""
+        return AffinePreprocess(self.shape, center_crop=self.center_crop, dtype='uint8')
+
+    def quantize(self, x):
+        """the uint8 resampled images of the model input x, the inverse of the scale and offset"""
+        x = (np.asarray(x, dtype=np.float64) - self.offset) / self.scale
+        return np.clip(np.rint(x), 0, 255).astype(np.uint8).reshape((-1,) + self.shape)
+
+    def __call__(self, imgs):
+        """preprocess images without perturbation, the same as preprocess_original_imgs"""
+        out = self.allocate(len(imgs))
+        for i in range(len(imgs)):
+            img = imgs[i]
+            M = self.matrix((img.shape[1], img.shape[0]))
+            self.normalize(cv2.warpAffine(img, M[:2], self.dsize, borderMode=cv2.BORDER_REPLICATE), out[i])
+        return out
+
+
+def dataset_resample(target):
+    """
+    the uint8 resample of the preprocessing of the dataset target (see AffinePreprocess.resample_only), None if
+    the dataset does not declare its preprocessing as affine_preprocess
+    """
+    if target is None or not hasattr(target, "affine_preprocess"):
+        return None
+    return target.affine_preprocess().resample_only()
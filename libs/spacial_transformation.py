@@ -39,6 +39,192 @@ def rotate_image(image, angle):
     return image
 
 
+def rotation_bound_matrix(rows, cols, angle):
+    """
+    the affine matrix and canvas size used by imutils.rotate_bound (see rotate_image)
+    return: 3x3 matrix, width, height
+    """
+    (c_x, c_y) = (cols / 2, rows / 2)
+    M = cv2.getRotationMatrix2D((c_x, c_y), -angle, 1.0)
+    cos = np.abs(M[0, 0])
+    sin = np.abs(M[0, 1])
+    n_w = int((rows * sin) + (cols * cos))
+    n_h = int((rows * cos) + (cols * sin))
+    M[0, 2] += (n_w / 2) - c_x
+    M[1, 2] += (n_h / 2) - c_y
+    return np.vstack([M, [0, 0, 1]]), n_w, n_h
+
+
+def resize_matrix(src_size, dst_size):
+    """
+    the affine matrix of cv2.resize (INTER_LINEAR) from src_size to dst_size, sizes are (cols, rows)
+    """
+    s_x = dst_size[0] * 1.0 / src_size[0]
+    s_y = dst_size[1] * 1.0 / src_size[1]
+    return np.array([[s_x, 0, 0.5 * (s_x - 1)],
+                     [0, s_y, 0.5 * (s_y - 1)],
+                     [0, 0, 1]], dtype=np.float64)
+
+
+def center_crop_matrix(size):
+    """
+    the affine matrix of the central square crop used before resizing (e.g., Cifar-10), size is (cols, rows)
+    return: 3x3 matrix, (cols, rows) of the cropped image
+    """
+    cols, rows = size
+    half = min(cols, rows) // 2
+    return np.array([[1, 0, half - cols // 2],
+                     [0, 1, half - rows // 2],
+                     [0, 0, 1]], dtype=np.float64), (2 * half, 2 * half)
+
+
+def geometric_matrix(shape, angle=0, translation=0, translation_v=0, shear=0, zoom=1):
+    """
+    compose rotate_image, image_translation_cropped, image_shear_cropped and image_zoom into one
+    affine matrix, so that a single warp produces the same image as the chain of transformations
+    return: 3x3 matrix, (cols, rows) of the output image
+    """
+    rows, cols = shape[:2]
+    M, cols, rows = rotation_bound_matrix(rows, cols, angle)
+
+    M = np.array([[1, 0, translation], [0, 1, translation_v], [0, 0, 1]], dtype=np.float64).dot(M)
+
+    factor = shear * (-1.0)
+    M = np.array([[1, factor, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64).dot(M)
+    crop = int(factor * cols)
+    if crop != 0:
+        # image_shear_cropped removes the sheared columns on one side
+        if shear < 0:
+            M = np.array([[1, 0, -crop], [0, 1, 0], [0, 0, 1]], dtype=np.float64).dot(M)
+            cols -= crop
+        else:
+            cols += crop
+
+    if zoom != 1:
+        size = (int(np.rint(cols * zoom)), int(np.rint(rows * zoom)))
+        M = np.array([[zoom, 0, 0.5 * (zoom - 1)],
+                      [0, zoom, 0.5 * (zoom - 1)],
+                      [0, 0, 1]], dtype=np.float64).dot(M)
+        cols, rows = size
+    return M, (cols, rows)
+
+
+def image_geometric_fused(img, angle=0, translation=0, translation_v=0, shear=0, zoom=1, dsize=None,
+                          preprocess=None):
+    """
+    rotation, translation, shear and zoom in a single cv2.warpAffine
+    dsize: (cols, rows) of the output, the transformed image is resized to dsize if given
+    preprocess: AffinePreprocess of the dataset, the transformed image is resampled to the model input if given
+    """
+    M, size = geometric_matrix(img.shape, angle, translation, translation_v, shear, zoom)
+    if preprocess is not None:
+        M = preprocess.matrix(size).dot(M)
+        size = preprocess.dsize
+    elif dsize is not None:
+        M = resize_matrix(size, dsize).dot(M)
+        size = tuple(dsize)
+    return cv2.warpAffine(img, M[:2], size)
+
+
+def batch_geometric_matrix(shape, params, dsize=None, center_crop=False):
+    """
+    vectorized geometric_matrix for a batch of images of the same shape
+    params: (N, 5) array of (rotation, translate, translate_v, shear, zoom)
+    dsize: (cols, rows), each transformed image is resized to dsize, default to the input size
+    center_crop: crop the central square of each transformed image before resizing (see center_crop_matrix)
+    return: (N, 3, 3) matrices
+    """
+    params = np.asarray(params, dtype=np.float64)
+    n = len(params)
+    rows, cols = shape[:2]
+    if dsize is None:
+        dsize = (cols, rows)
+
+    # rotation with bounded canvas, the same as rotation_bound_matrix
+    (c_x, c_y) = (cols / 2, rows / 2)
+    theta = np.deg2rad(-params[:, 0])
+    alpha = np.cos(theta)
+    beta = np.sin(theta)
+    cos = np.abs(alpha)
+    sin = np.abs(beta)
+    n_w = ((rows * sin) + (cols * cos)).astype(int)
+    n_h = ((rows * cos) + (cols * sin)).astype(int)
+    M = np.zeros((n, 3, 3))
+    M[:, 0, 0] = alpha
+    M[:, 0, 1] = beta
+    M[:, 0, 2] = (1 - alpha) * c_x - beta * c_y + (n_w / 2) - c_x
+    M[:, 1, 0] = -beta
+    M[:, 1, 1] = alpha
+    M[:, 1, 2] = beta * c_x + (1 - alpha) * c_y + (n_h / 2) - c_y
+    M[:, 2, 2] = 1
+
+    # translation
+    M[:, 0, :] += params[:, 1:2] * M[:, 2, :]
+    M[:, 1, :] += params[:, 2:3] * M[:, 2, :]
+
+    # shear and crop
+    factor = params[:, 3] * (-1.0)
+    M[:, 0, :] += factor[:, np.newaxis] * M[:, 1, :]
+    crop = np.trunc(factor * n_w).astype(int)
+    left = np.where(params[:, 3] < 0, crop, 0)
+    M[:, 0, :] -= left[:, np.newaxis] * M[:, 2, :]
+    n_w = n_w - np.abs(crop)
+
+    # zoom
+    zoom = params[:, 4]
+    n_w = np.rint(n_w * zoom)
+    n_h = np.rint(n_h * zoom)
+    M[:, :2, :] *= zoom[:, np.newaxis, np.newaxis]
+    M[:, :2, 2] += 0.5 * (zoom[:, np.newaxis] - 1)
+
+    if center_crop:
+        n_w = n_w.astype(int)
+        n_h = n_h.astype(int)
+        half = np.minimum(n_w, n_h) // 2
+        M[:, 0, :] += (half - n_w // 2)[:, np.newaxis] * M[:, 2, :]
+        M[:, 1, :] += (half - n_h // 2)[:, np.newaxis] * M[:, 2, :]
+        n_w = n_h = 2 * half
+
+    # resize to dsize
+    s_x = dsize[0] * 1.0 / n_w
+    s_y = dsize[1] * 1.0 / n_h
+    M[:, 0, :] *= s_x[:, np.newaxis]
+    M[:, 1, :] *= s_y[:, np.newaxis]
+    M[:, 0, 2] += 0.5 * (s_x - 1)
+    M[:, 1, 2] += 0.5 * (s_y - 1)
+    return M
+
+
+def batch_warp_affine(imgs, matrices, dsize):
+    """
+    bilinear warp of a batch of images with constant (zero) border, each image with its own matrix
+    imgs: (N, rows, cols[, ch]) array; matrices: (N, 3, 3) forward matrices; dsize: (cols, rows) of the output
+    """
+    imgs = np.asarray(imgs)
+    n = len(imgs)
+    rows, cols = imgs.shape[1:3]
+    out_cols, out_rows = dsize
+
+    # stack the images into one zero padded mosaic, so that a single cv2.remap warps the whole batch
+    mosaic = np.zeros((n, rows + 2, cols + 2) + imgs.shape[3:], dtype=imgs.dtype)
+    mosaic[:, 1:-1, 1:-1] = imgs
+    mosaic = mosaic.reshape((n * (rows + 2), cols + 2) + imgs.shape[3:])
+
+    # sampling grid: map every output pixel back to its source image
+    inv = np.linalg.inv(matrices)[:, :2].astype(np.float32)
+    ys, xs = np.mgrid[0:out_rows, 0:out_cols].astype(np.float32)
+    map_x = inv[:, 0, 0, None, None] * xs + inv[:, 0, 1, None, None] * ys + inv[:, 0, 2, None, None]
+    map_y = inv[:, 1, 0, None, None] * xs + inv[:, 1, 1, None, None] * ys + inv[:, 1, 2, None, None]
+    outside = (map_x <= -1) | (map_x >= cols) | (map_y <= -1) | (map_y >= rows)
+    map_x += 1
+    map_y += 1 + (np.arange(n, dtype=np.float32) * (rows + 2))[:, None, None]
+    map_x[outside] = -2
+
+    out = cv2.remap(mosaic, map_x.reshape(n * out_rows, out_cols), map_y.reshape(n * out_rows, out_cols),
+                    cv2.INTER_LINEAR)
+    return out.reshape((n, out_rows, out_cols) + imgs.shape[3:])
+
+
 def image_zoom(image, param):
     """ param: 1-2 """
     res = cv2.resize(image, None, fx=param, fy=param, interpolation=cv2.INTER_LINEAR)
@@ -47,7 +233,7 @@ def image_zoom(image, param):
 
 
 def image_blur(image, params):
-    blur = cv2.blur(image, (params+1, params+1))
+    blur = cv2.blur(image, (int(params)+1, int(params)+1))
     return blur
 
 
@@ -70,6 +256,14 @@ def image_contrast(image, param):
     return image
 
 
+def photometric_lut(brightness=0, contrast=1):
+    """
+    the 256-entry lookup table of image_brightness followed by image_contrast
+    both are pointwise functions of uint8 values, so the table gives the same result with a single pass
+    """
+    return image_contrast(image_brightness(np.arange(256, dtype=np.uint8), brightness), contrast)
+
+
 def save_object(obj, filename):
     with open(filename, 'wb') as output:
         pickle.dump(obj, output, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,65 @@
+"""
+This program is to test that the batched perturbation produces the images of the chain of transformations
+followed by the preprocessing of the dataset (the center crop and resize of Cifar-10)
+"""
+
+import os
+import sys
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from perturbator import Perturbator
+from libs.preprocess import AffinePreprocess
+
+PARAMS = np.array([[0, 2, -1, 0, 1, 0, 0, 1],
+                   [10, 0, 1, 0.05, 1, 0, 0, 1],
+                   [-25, 3, 0, -0.08, 1, 0, 0, 1],
+                   [30, -2, 2, 0.1, 1, 0, 0, 1],
+                   [5, 1, -3, -0.02, 1, 0, 0, 1],
+                   [-7, 0, 0, 0, 1, 0, 0, 1]], dtype=np.float64)
+
+
+def smooth_images(n, rows=32, cols=32):
+    x = (np.random.RandomState(0).rand(n, rows, cols, 3) * 255).astype(np.uint8)
+    return np.array([cv2.GaussianBlur(img, (5, 5), 0) for img in x])
+
+
+def crop_resize(img, size):
+    """the preprocessing of Cifar-10 (cv2_preprocess_img)"""
+    min_side = min(img.shape[:-1])
+    centre = img.shape[0] // 2, img.shape[1] // 2
+    img = img[centre[0] - min_side // 2:centre[0] + min_side // 2,
+              centre[1] - min_side // 2:centre[1] + min_side // 2]
+    return cv2.resize(img, (size, size))
+
+
+def test_batch_perturb_center_crop():
+    pt = Perturbator()
+    x = smooth_images(len(PARAMS))
+    chain = np.array([crop_resize(pt.chain_perturb_img(img, *p), 24) for img, p in zip(x, PARAMS)])
+    pt.resample = AffinePreprocess((24, 24, 3), center_crop=True).resample_only()
+    batch = pt.batch_perturb(x, PARAMS)
+    assert batch.shape == chain.shape and batch.dtype == np.uint8
+    # the same up to the interpolation of the single warp, without the crop the images are stretched
+    assert np.mean(np.abs(batch.astype(int) - chain)) < 4
+    pt.resample = AffinePreprocess((24, 24, 3)).resample_only()
+    assert np.mean(np.abs(pt.batch_perturb(x, PARAMS).astype(int) - chain)) > 6
+
+
+def test_batch_perturb_dsize():
+    pt = Perturbator()
+    x = smooth_images(2)
+    assert pt.batch_perturb(x, PARAMS[:2]).shape == x.shape
+    try:
+        pt.batch_perturb(x, PARAMS[:2], dsize=(24, 24))
+    except Exception:
+        return
+    raise AssertionError("resizing without the crop of the dataset should raise")
+
+
+if __name__ == '__main__':
+    test_batch_perturb_center_crop()
+    test_batch_perturb_dsize()
+    print("batch perturb test passed")
@@ -0,0 +1,57 @@
+"""
+This program is to test that the confusion cap of the worst candidates selects as the loop of select_worst
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from data_generator import DataGenerator
+
+
+def loop_cap(label_record, index, second, pred_all, labels, limit):
+    """the cap of select_worst, image by image"""
+    index = np.array(index)
+    for j in range(len(index)):
+        true_label = labels[j]
+        predict_label = pred_all[index[j], j]
+        if true_label != predict_label and label_record[true_label][predict_label] > limit:
+            index[j] = second[j]
+            predict_label = pred_all[index[j], j]
+        label_record[true_label][predict_label] += 1
+    return index
+
+
+def test_cap_confusion():
+    rng = np.random.RandomState(0)
+    generator = DataGenerator.__new__(DataGenerator)
+    for trial in range(300):
+        n, num_classes, num_candidates = rng.randint(1, 40), rng.randint(2, 5), rng.randint(2, 6)
+        record = rng.randint(0, 8, (num_classes, num_classes))
+        pred_all = rng.randint(0, num_classes, (num_candidates, n))
+        labels = rng.randint(0, num_classes, n)
+        order = np.argsort(rng.rand(num_candidates, n), axis=0)
+        generator.label_record = record.copy()
+        index = generator.cap_confusion(order[-1], order[-2], pred_all, labels, limit=5)
+        expected_record = record.copy()
+        expected = loop_cap(expected_record, order[-1], order[-2], pred_all, labels, 5)
+        assert np.array_equal(index, expected), trial
+        assert np.array_equal(generator.label_record, expected_record), trial
+
+
+def test_not_allowed():
+    generator = DataGenerator.__new__(DataGenerator)
+    generator.label_record = np.array([[0, 10], [0, 0]])
+    pred_all = np.array([[0, 0], [1, 1]])
+    index = generator.cap_confusion(np.array([1, 1]), np.array([0, 0]), pred_all, np.array([0, 0]),
+                                    np.array([True, False]), limit=5)
+    assert index.tolist() == [0, 1]
+    assert generator.label_record.tolist() == [[1, 11], [0, 0]]
+
+
+if __name__ == '__main__':
+    test_cap_confusion()
+    test_not_allowed()
+    print("cap confusion test passed")
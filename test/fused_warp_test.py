@@ -0,0 +1,62 @@
+"""
+This program is to test that the single (fused) warp of the spacial transformations produces the images of the
+chain of transformations, and that the batched matrices are the matrices of each image
+"""
+
+import os
+import sys
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from perturbator import Perturbator
+from libs.preprocess import AffinePreprocess
+from libs.spacial_transformation import geometric_matrix, batch_geometric_matrix, resize_matrix
+
+# rotation, translation, translation_v, shear, zoom
+PARAMS = np.array([[0, 0, 0, 0, 1],
+                   [15, 2, -1, 0.1, 1],
+                   [-30, -3, 3, -0.2, 1],
+                   [7, 1, 0, 0.05, 1.2],
+                   [-12, 0, -2, -0.1, 0.9],
+                   [25, 3, 2, 0.15, 1.1]], dtype=np.float64)
+
+
+def smooth_images(n, rows=32, cols=32):
+    x = (np.random.RandomState(0).rand(n, rows, cols, 3) * 255).astype(np.uint8)
+    return np.array([cv2.GaussianBlur(img, (5, 5), 0) for img in x])
+
+
+def test_fused_chain():
+    pt = Perturbator()
+    pt.enable_filters = True
+    for img, p in zip(smooth_images(len(PARAMS)), PARAMS):
+        chain = pt.chain_perturb_img(img, *p)
+        fused = pt.fused_perturb_img(img, *p)
+        assert chain.shape == fused.shape
+        # the same up to the interpolation of the chain of warps, the resize of the zoom blurs the edges more
+        diff = np.abs(chain.astype(int) - fused)
+        assert np.mean(diff) < (2 if p[4] == 1 else 4), (p, np.mean(diff))
+
+
+def test_batch_geometric_matrix():
+    shape = (32, 32, 3)
+    for dsize in [(32, 32), (24, 24)]:
+        batch = batch_geometric_matrix(shape, PARAMS, dsize)
+        for M, p in zip(batch, PARAMS):
+            single, size = geometric_matrix(shape, *p)
+            single = resize_matrix(size, dsize).dot(single)
+            assert np.allclose(M, single), (p, M, single)
+    # the center crop and resize of the preprocessing of the dataset
+    preprocess = AffinePreprocess((24, 24, 3), center_crop=True)
+    batch = batch_geometric_matrix(shape, PARAMS, preprocess.dsize, center_crop=True)
+    for M, p in zip(batch, PARAMS):
+        single, size = geometric_matrix(shape, *p)
+        assert np.allclose(M, preprocess.matrix(size).dot(single)), p
+
+
+if __name__ == '__main__':
+    test_fused_chain()
+    test_batch_geometric_matrix()
+    print("fused warp test passed")
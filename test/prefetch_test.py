@@ -0,0 +1,42 @@
+"""
+This program is to test the order of the batches generated by the prefetcher across epochs
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from prefetch import Prefetcher
+
+
+def test_shuffled_epochs():
+    prefetcher = Prefetcher(lambda index: index, 16, staleness=2, seed=0)
+    orders = []
+    for epoch in range(3):
+        orders.append([prefetcher.get(i) for i in range(16)])
+        prefetcher.end_epoch()
+    for order in orders:
+        assert sorted(order) == list(range(16))
+    assert orders[0] != orders[1] and orders[1] != orders[2]
+
+
+def test_out_of_order():
+    prefetcher = Prefetcher(lambda index: index, 8, seed=0)
+    order = list(prefetcher.order)
+    assert prefetcher.get(0) == order[0]
+    assert prefetcher.get(5) == order[5]  # generated again from 5
+    assert prefetcher.get(6) == order[6]
+    prefetcher.stop()
+
+
+def test_in_order():
+    prefetcher = Prefetcher(lambda index: index, 8, shuffle=False)
+    assert [prefetcher.get(i) for i in range(8)] == list(range(8))
+    prefetcher.end_epoch()
+
+
+if __name__ == '__main__':
+    test_shuffled_epochs()
+    test_out_of_order()
+    test_in_order()
+    print("prefetch test passed")
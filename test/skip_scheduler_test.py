@@ -0,0 +1,64 @@
+"""
+This program is to test the schedule of the samples skipped by selective augmentation over several epochs
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from skip_scheduler import SkipScheduler
+
+
+def run_schedule(scheduler, robust, epochs):
+    """the skipped flag of each sample in each epoch, robust(epoch) is the robustness of the samples in the epoch"""
+    skipped = []
+    for epoch in range(epochs):
+        skipped.append(scheduler.skipped.copy())
+        scheduler.observe(np.arange(len(scheduler.skipped)), robust(epoch))
+        scheduler.end_epoch()
+    return np.array(skipped)
+
+
+def gaps(skipped):
+    """the number of skipped epochs between the full evaluations of a sample"""
+    evaluated = [epoch for epoch, skip in enumerate(skipped) if not skip]
+    return [b - a - 1 for a, b in zip(evaluated[:-1], evaluated[1:])]
+
+
+def test_backoff():
+    # a sample that stays robust is skipped for 1, 2, 4, ... epochs after its full evaluations
+    skipped = run_schedule(SkipScheduler(1), lambda epoch: [True], 40)
+    assert gaps(skipped[:, 0]) == [1, 2, 4, 8, 16]
+
+
+def test_max_epochs():
+    # the backoff stops at max_epochs
+    skipped = run_schedule(SkipScheduler(1, max_epochs=3), lambda epoch: [True], 20)
+    assert gaps(skipped[:, 0]) == [1, 2, 3, 3, 3]
+    skipped = run_schedule(SkipScheduler(1, max_epochs=1), lambda epoch: [True], 6)
+    assert skipped[:, 0].tolist() == [False, True, False, True, False, True]
+
+
+def test_reenter():
+    # a skipped sample that is not robust anymore is evaluated in the next epoch, and its backoff starts again
+    scheduler = SkipScheduler(2)
+    skipped = run_schedule(scheduler, lambda epoch: [epoch != 3, epoch != 2], 8)
+    assert skipped[:, 0].tolist() == [False, True, False, True, False, True, False, True]
+    assert skipped[:, 1].tolist() == [False, True, False, False, True, False, True, True]
+    assert scheduler.streak.tolist() == [2, 2]
+
+
+def test_audit():
+    scheduler = SkipScheduler(1000, audit=0.5, seed=0)
+    skipped = run_schedule(scheduler, lambda epoch: np.ones(1000, dtype=bool), 4)
+    assert not skipped[0].any()
+    assert 0.3 < np.mean(skipped[1:]) < 0.7
+
+
+if __name__ == '__main__':
+    test_backoff()
+    test_max_epochs()
+    test_reenter()
+    test_audit()
+    print("skip scheduler test passed")
@@ -0,0 +1,53 @@
+"""
+This program is to test that the robust thresholds calibrated online keep the fraction of the skipped samples of
+every class near the target over several epochs
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from data_generator import DataGenerator
+from skip_scheduler import SkipScheduler
+from thresholds import ClassThresholds
+
+
+class Config:
+    robust_basedon_acc = False
+
+
+def test_skip_target():
+    rng = np.random.RandomState(0)
+    num_classes, target, batch_size = 4, 0.3, 100
+    labels = np.repeat(np.arange(num_classes), 500)
+    y = np.eye(num_classes)[labels]
+    # the loss of the classes differs by orders of magnitude, and a sample keeps its difficulty across epochs
+    difficulty = rng.lognormal(0, 1, len(labels)) * np.array([0.1, 1, 5, 20])[labels]
+    generator = DataGenerator.__new__(DataGenerator)
+    generator.config = Config()
+    generator.skip = SkipScheduler(len(labels))
+    generator.thresholds = ClassThresholds(num_classes, target, history=512)
+    robust_fraction, skipped_fraction = [], []
+    for epoch in range(12):
+        loss = difficulty * rng.lognormal(0, 0.3, len(labels))
+        # the skipped samples are scored on their top candidate only, of lower loss than the worst candidate
+        loss = np.where(generator.skip.skipped, 0.7 * loss, loss)
+        robust = np.zeros(len(labels), dtype=bool)
+        for start in range(0, len(labels), batch_size):
+            rows = slice(start, start + batch_size)
+            robust[rows] = loss[rows] < generator.robust_threshold(labels[rows])
+            generator.observe_robust(start, start + batch_size, y[rows], robust_loss=loss[rows])
+        generator.skip.end_epoch()
+        robust_fraction.append([np.mean(robust[labels == c]) for c in range(num_classes)])
+        skipped_fraction.append([np.mean(generator.skip.skipped[labels == c]) for c in range(num_classes)])
+    # the samples found robust in each epoch, skipped unless their backoff expires, are the target fraction
+    assert np.all(np.abs(np.array(robust_fraction[1:]) - target) < 0.06), robust_fraction
+    skipped_fraction = np.mean(skipped_fraction[2:], axis=0)
+    assert np.all((skipped_fraction > target - 0.12) & (skipped_fraction < target + 0.02)), skipped_fraction
+
+
+if __name__ == '__main__':
+    test_skip_target()
+    print("thresholds test passed")
@@ -1,23 +1,28 @@
-from augment.transformation import Transformation
+from augment.transformation import Transformation, BatchOperator
+from augment.lattice import Lattice
+import numpy as np
 import copy
 
 if __name__ == '__main__':
     trs = Transformation()
     trss = [trs]
     print trs.get_paras()
-    mutates = trs.mutate(trss, 1)
+    op = BatchOperator()
+    lattice = Lattice.shared()
+    mutates = op.mutate(lattice.encode([[trs.get_paras()]]), np.array([1]), np.array([0]))[0]
     print "======================== mutate ==========================="
     for i in range(len(mutates)):
-        print mutates[i].get_paras()
+        print tuple(lattice.decode(mutates[i]))
 
     print "======================== crossover ==========================="
     trs2 = Transformation(1, 1, 1, 1, 1, 1, 1)
     trs3 = Transformation(1, 1, 0, 1, 0, 0, 1)
 
     trss = [trs2, trs3]
-    crossovers = trs.crossover(trs2, trss, 1)
+    existing = lattice.encode([[trs.get_paras()] + [t.get_paras() for t in trss]])
+    crossovers = op.crossover(existing, lattice.encode([trs2.get_paras()]), np.array([1]), np.array([0]))[0]
     for i in range(len(crossovers)):
-        print crossovers[i].get_paras()
+        print tuple(lattice.decode(crossovers[i]))
 
     print "======================== print parameters ==========================="
     trs_new = Transformation(*(trs.get_paras()))
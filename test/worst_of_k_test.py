@@ -0,0 +1,77 @@
+"""
+This program is to test that the worst of k perturbations selected chunk by chunk (streaming argmax) is the worst
+one of the argmax over all the perturbations at once
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "augment"))
+from data_generator import DataGenerator
+from arena import Arena
+
+
+class SumScorer:
+    """the loss of an image is the sum of its pixels, few distinct values so that the losses tie"""
+
+    def score(self, x, y):
+        loss = np.asarray(x, dtype=np.float64).reshape(len(x), -1).sum(axis=1)
+        return loss, (loss % 3).astype(int), np.zeros(len(x))
+
+
+class Graph:
+    def as_default(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def streaming_generator():
+    generator = DataGenerator.__new__(DataGenerator)
+    generator.arena = Arena()
+    generator.scorer = SumScorer()
+    generator.graph = Graph()
+    generator.predict_time = 0
+    return generator
+
+
+def streaming_worst(x_k, y, unrobust, chunk):
+    generator = streaming_generator()
+    n = x_k.shape[1]
+    max_loss = np.full(n, -np.inf)
+    correct = np.ones(n, dtype=bool)
+    out = np.empty_like(x_k[0])
+    for first in range(0, len(x_k), chunk):
+        generator.score_worst(x_k[first:first+chunk], y, unrobust, first == 0, max_loss, correct, out)
+    return out, max_loss, correct
+
+
+def test_streaming_argmax():
+    rng = np.random.RandomState(0)
+    k, n = 10, 16
+    x_k = rng.randint(0, 2, (k, n, 2, 2, 3)).astype(np.uint8)
+    y = np.eye(3)[rng.randint(0, 3, n)]
+    for robust in [np.zeros(n, dtype=bool), rng.rand(n) < 0.5]:
+        unrobust = np.nonzero(~robust)[0]
+        loss = x_k.reshape(k, n, -1).sum(axis=2).astype(np.float64)
+        predict = loss % 3
+        loss[1:, robust] = -np.inf  # only the first perturbation of the robust nodes is evaluated
+        index = np.argmax(loss, axis=0)  # the first perturbation with the max loss
+        evaluated = loss > -np.inf
+        expected_correct = np.all(~evaluated | (predict == np.argmax(y, axis=1)), axis=0)
+        for chunk in [1, 3, 4, k]:
+            out, max_loss, correct = streaming_worst(x_k, y, unrobust, chunk)
+            assert np.array_equal(out, x_k[index, np.arange(n)]), chunk
+            assert np.array_equal(max_loss, loss[index, np.arange(n)]), chunk
+            assert np.array_equal(correct, expected_correct), chunk
+
+
+if __name__ == '__main__':
+    test_streaming_argmax()
+    print("worst of k test passed")